@@ -0,0 +1,381 @@
+"""
+Offline benchmark suite for the journal.
+
+Builds synthetic journals (default 1k/10k/100k/1M trades over many accounts)
+and times the TradeManager hot paths against the CSV backend and an
+in-process fake gspread spreadsheet. Quotes come from a stub fdr.DataReader
+with configurable latency, so nothing touches the network.
+
+    python benchmark.py [--sizes 1000,10000] [--backends csv,partitioned,sheets]
+                        [--quote-latency 0.05] [--sheets-latency 0.0]
+                        [--output bench_results.json] [--compare old.json]
+
+Results are one JSON document (environment + one record per backend/size/operation);
+--compare prints the ratio against an earlier run.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import storage
+import trade_logic
+from storage import (
+    ACCOUNTS_FILE, TRADES_FILE, ACCOUNT_COLUMNS, TRADE_COLUMNS, CSVBackend, PartitionedCSVBackend, SheetsBackend,
+)
+from trade_logic import TradeManager
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+DEFAULT_BACKENDS = ["csv", "sheets"]
+BENCH_ACCOUNTS = 50
+BENCH_SYMBOLS = 2000
+BENCH_OPEN_RATIO = 0.02
+BENCH_MAX_OPEN = 500
+BENCH_REPEAT = 5
+
+
+# --- Fakes -------------------------------------------------------------------
+
+class FakeWorksheet:
+    """In-memory stand-in for gspread.Worksheet (the calls SheetsBackend makes)."""
+    def __init__(self, sheet, title):
+        self.sheet = sheet
+        self.title = title
+        self.rows = []
+
+    def _call(self, write=False):
+        self.sheet.api_calls += 1
+        if write:
+            self.sheet.revision += 1
+        if self.sheet.latency:
+            time.sleep(self.sheet.latency)
+
+    def get_all_values(self):
+        self._call()
+        return [list(r) for r in self.rows]
+
+    def get_all_records(self):
+        self._call()
+        if len(self.rows) < 2:
+            return []
+        header = self.rows[0]
+        return [dict(zip(header, r)) for r in self.rows[1:]]
+
+    def row_values(self, row):
+        self._call()
+        return list(self.rows[row - 1]) if len(self.rows) >= row else []
+
+    def append_row(self, values, **kwargs):
+        self._call(write=True)
+        self.rows.append(list(values))
+
+    def append_rows(self, values, **kwargs):
+        self._call(write=True)
+        self.rows.extend(list(v) for v in values)
+
+    def clear(self):
+        self._call(write=True)
+        self.rows = []
+
+    def update(self, values=None, range_name=None, **kwargs):
+        self._call(write=True)
+        self.rows = [list(r) for r in values]
+
+    def update_cell(self, row, col, value):
+        self._call(write=True)
+        self._set(row, col, value)
+
+    def batch_update(self, data, **kwargs):
+        from gspread.utils import a1_to_rowcol
+
+        self._call(write=True)
+        for item in data:
+            row, col = a1_to_rowcol(item["range"].split(":")[0])
+            for i, values in enumerate(item["values"]):
+                for j, value in enumerate(values):
+                    self._set(row + i, col + j, value)
+
+    def _set(self, row, col, value):
+        while len(self.rows) < row:
+            self.rows.append([])
+        cells = self.rows[row - 1]
+        while len(cells) < col:
+            cells.append("")
+        cells[col - 1] = value
+
+
+class FakeSpreadsheet:
+    """In-memory stand-in for gspread.Spreadsheet with an API call counter."""
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.api_calls = 0
+        self.revision = 0
+        self._sheets = {}
+
+    def worksheets(self):
+        self.api_calls += 1
+        return list(self._sheets.values())
+
+    def worksheet(self, title):
+        self.api_calls += 1
+        return self._sheets[title]
+
+    def add_worksheet(self, title, rows, cols):
+        self.api_calls += 1
+        self._sheets[title] = FakeWorksheet(self, title)
+        return self._sheets[title]
+
+    def get_lastUpdateTime(self):
+        self.api_calls += 1
+        return str(self.revision)
+
+
+def install_quote_stub(latency, workdir):
+    """Replaces fdr.DataReader/StockListing with offline stubs; quote state starts empty."""
+    import FinanceDataReader as fdr
+
+    def data_reader(symbol, start=None, end=None, *args, **kwargs):
+        if latency:
+            time.sleep(latency)
+        index = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=5)
+        close = 10000 + (int(symbol) % 500) * 100 if str(symbol).isdigit() else 10000
+        bars = np.full(len(index), float(close))
+        return pd.DataFrame({"Open": bars, "High": bars, "Low": bars, "Close": bars, "Volume": 1000}, index=index)
+
+    def stock_listing(market):
+        codes = [f"{i:06d}" for i in range(BENCH_SYMBOLS)]
+        return pd.DataFrame({"Code": codes, "Name": [f"종목{c}" for c in codes]})
+
+    fdr.DataReader = data_reader
+    fdr.StockListing = stock_listing
+    reset_quotes(workdir)
+
+
+def reset_quotes(workdir):
+    # Cold quote path: empty memory cache and an empty local OHLC store
+    trade_logic.QUOTE_CACHE.invalidate()
+    root = os.path.join(workdir, "ohlc")
+    shutil.rmtree(root, ignore_errors=True)
+    trade_logic.OHLC_STORE = trade_logic.OHLCStore(root)
+
+
+# --- Synthetic journals ----------------------------------------------------
+
+def synthetic_journal(n_trades, n_accounts=BENCH_ACCOUNTS, seed=0):
+    """Returns (accounts, trades) DataFrames with the storage column layout."""
+    rng = np.random.default_rng(seed)
+    account_ids = [f"ACC{i:03d}" for i in range(n_accounts)]
+    accounts = pd.DataFrame({
+        "AccountID": account_ids,
+        "Name": [f"계좌 {i}" for i in range(n_accounts)],
+        "Broker": "Kiwoom",
+        "Currency": "KRW",
+        "InitialBalance": 100000000,
+        "CurrentBalance": 100000000.0,
+    })[ACCOUNT_COLUMNS]
+
+    entry = rng.integers(1000, 200000, n_trades).astype(float)
+    stop = np.round(entry * 0.92)
+    qty = rng.integers(1, 500, n_trades)
+    n_open = min(int(n_trades * BENCH_OPEN_RATIO), BENCH_MAX_OPEN)
+    status = np.array(["Closed"] * n_trades, dtype=object)
+    status[rng.choice(n_trades, n_open, replace=False)] = "Open"
+    is_open = status == "Open"
+    exit_price = np.where(is_open, 0.0, np.round(entry * rng.uniform(0.85, 1.3, n_trades)))
+    entry_dates = pd.Timestamp("2015-01-01") + pd.to_timedelta(rng.integers(0, 3650, n_trades), unit="D")
+    exit_dates = entry_dates + pd.to_timedelta(rng.integers(1, 90, n_trades), unit="D")
+    pnl = trade_logic.calculate_pnl(entry, qty, exit_price, stop)
+
+    trades = pd.DataFrame({
+        "TradeID": np.arange(1, n_trades + 1),
+        "AccountID": rng.choice(account_ids, n_trades),
+        "Symbol": [f"{s:06d}" for s in rng.integers(0, BENCH_SYMBOLS, n_trades)],
+        "EntryDate": entry_dates.strftime("%Y-%m-%d"),
+        "Strategy": rng.choice(["Breakout", "Pullback", "Import"], n_trades),
+        "TrendScore": rng.integers(1, 4, n_trades),
+        "EntryPrice": entry,
+        "StopLoss": stop,
+        "Quantity": qty,
+        "UnitQuantity": qty // 3,
+        "RiskAmount": (qty * (entry - stop)).astype(int),
+        "Status": status,
+        "ExitDate": np.where(is_open, "", exit_dates.strftime("%Y-%m-%d")),
+        "ExitPrice": exit_price,
+        "PnL": np.where(is_open, 0.0, pnl["NetPnL"].to_numpy()),
+        "R_Multiple": np.where(is_open, 0.0, pnl["R_Multiple"].round(2).to_numpy()),
+    })[TRADE_COLUMNS]
+    return accounts, trades
+
+
+def make_backend(kind, workdir, accounts, trades, sheets_latency=0.0):
+    """Seeds a fresh backend with the journal (seeding is not timed)."""
+    if kind in ("csv", "partitioned"):
+        backend = (CSVBackend if kind == "csv" else PartitionedCSVBackend)(
+            trades_file=os.path.join(workdir, TRADES_FILE),
+            accounts_file=os.path.join(workdir, ACCOUNTS_FILE),
+            meta_file=os.path.join(workdir, storage.META_FILE),
+        )
+        backend.write_table(ACCOUNTS_FILE, accounts)
+        backend.write_table(TRADES_FILE, trades)
+        backend.write_meta("last_trade_id", int(trades["TradeID"].max()))
+        return backend, None
+    if kind == "sheets":
+        sheet = FakeSpreadsheet()
+        backend = SheetsBackend(sheet)
+        backend.write_table(ACCOUNTS_FILE, accounts)
+        backend.write_table(TRADES_FILE, trades)
+        backend.write_meta("last_trade_id", int(trades["TradeID"].max()))
+        # Count only the calls made by the benchmarked operations
+        sheet.latency = sheets_latency
+        sheet.api_calls = 0
+        return backend, sheet
+    raise ValueError(f"Unknown backend: {kind}")
+
+
+# --- Runner ----------------------------------------------------------------
+
+def _timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_backend(kind, size, workdir, quote_latency, sheets_latency, repeat):
+    accounts, trades = synthetic_journal(size)
+    backend, sheet = make_backend(kind, workdir, accounts, trades, sheets_latency)
+    results = []
+
+    def record(op, fn, runs=repeat):
+        calls_before = sheet.api_calls if sheet else 0
+        samples = _timed(fn, runs)
+        results.append({
+            "backend": kind,
+            "trades": size,
+            "operation": op,
+            "runs": runs,
+            "median_s": round(statistics.median(samples), 6),
+            "min_s": round(min(samples), 6),
+            "api_calls_per_run": ((sheet.api_calls - calls_before) / runs) if sheet else None,
+        })
+
+    tm = TradeManager(backend=backend)
+    account = accounts["AccountID"].iloc[0]
+    state = {"next_close": iter(trades.loc[trades["Status"] == "Open", "TradeID"].tolist())}
+
+    record("init + first get_trades (cold)", lambda: TradeManager(backend=backend).get_trades(), runs=1)
+    record("get_trades (warm)", tm.get_trades)
+    record("get_trades(account, Open)", lambda: tm.get_trades(account, "Open"))
+    record("add_trade", lambda: tm.add_trade(account, "005930", "Breakout", 3, 70000, 64400, 10, 3, 56000))
+    record("close_trade", lambda: tm.close_trade(next(state["next_close"]), 75000))
+    record("update_trade", lambda: tm.update_trade(1, {"Strategy": "Edited"}))
+    record("calculate_position", lambda: tm.calculate_position(100000000, 1.0, 70000, 64400, 3), runs=repeat * 100)
+
+    open_trades = tm.get_trades(status="Open")
+    def mark_to_market():
+        reset_quotes(workdir)
+        tm.value_positions(open_trades)
+    record(f"mark-to-market ({len(open_trades)} open, cold quotes)", mark_to_market, runs=1)
+    record(f"mark-to-market ({len(open_trades)} open, cached quotes)", lambda: tm.value_positions(open_trades))
+
+    balance = float(accounts["CurrentBalance"].iloc[0])
+    record("rename_account", lambda: tm.update_account(account, f"renamed-{time.perf_counter_ns()}", balance))
+
+    # Destructive: last
+    record("delete_account", lambda: tm.delete_account(accounts["AccountID"].iloc[-1]), runs=1)
+    return results
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(sizes, backends, quote_latency=0.0, sheets_latency=0.0, repeat=BENCH_REPEAT, progress=print):
+    report = {
+        "commit": _git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "params": {"sizes": sizes, "backends": backends, "quote_latency": quote_latency,
+                   "sheets_latency": sheets_latency, "repeat": repeat, "accounts": BENCH_ACCOUNTS},
+        "results": [],
+    }
+    cwd = os.getcwd()
+    for size in sizes:
+        for kind in backends:
+            workdir = tempfile.mkdtemp(prefix="journal-bench-")
+            try:
+                # Listing/OHLC files land in the scratch directory
+                os.chdir(workdir)
+                install_quote_stub(quote_latency, workdir)
+                progress(f"{kind:>6} {size:>9,} trades ...")
+                report["results"].extend(bench_backend(kind, size, workdir, quote_latency, sheets_latency, repeat))
+            finally:
+                os.chdir(cwd)
+                shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+def compare(report, baseline):
+    """Yields (backend, trades, operation, baseline median, current median, ratio)."""
+    key = lambda r: (r["backend"], r["trades"], r["operation"])
+    old = {key(r): r for r in baseline["results"]}
+    for r in report["results"]:
+        prev = old.get(key(r))
+        if prev and prev["median_s"]:
+            yield key(r) + (prev["median_s"], r["median_s"], r["median_s"] / prev["median_s"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline journal benchmarks")
+    parser.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_SIZES),
+                        help="Comma-separated trade counts")
+    parser.add_argument("--backends", default=",".join(DEFAULT_BACKENDS), help="csv,partitioned,sheets")
+    parser.add_argument("--quote-latency", type=float, default=0.05, help="Seconds per stub DataReader call")
+    parser.add_argument("--sheets-latency", type=float, default=0.0, help="Seconds per fake Sheets API call")
+    parser.add_argument("--repeat", type=int, default=BENCH_REPEAT)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    report = run(sizes, backends, args.quote_latency, args.sheets_latency, args.repeat)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    for r in report["results"]:
+        calls = f"{r['api_calls_per_run']:g} calls" if r["api_calls_per_run"] is not None else ""
+        print(f"{r['backend']:>6} {r['trades']:>9,}  {r['operation']:<45} {r['median_s'] * 1000:10.2f} ms  {calls}")
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"Compared with {args.compare} (commit {baseline.get('commit')}):")
+        for backend, trades, op, before, after, ratio in compare(report, baseline):
+            flag = "  <-- slower" if ratio > 1.2 else ""
+            print(f"{backend:>6} {trades:>9,}  {op:<45} {before * 1000:9.2f} -> {after * 1000:9.2f} ms  x{ratio:.2f}{flag}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
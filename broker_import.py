@@ -0,0 +1,326 @@
+"""
+Bulk import of broker execution (fill) exports into the journal.
+
+Fills are streamed in chunks, paired FIFO per symbol (each buy fill is a lot,
+sells close the oldest lots first), priced with the journal's fee model and
+appended in a single TradeManager batch. Open trades left by earlier imports
+are seeded as lots, so an incremental export can close them.
+"""
+import hashlib
+import itertools
+import os
+import tempfile
+from collections import deque
+
+import pandas as pd
+
+from trade_logic import calculate_pnl, normalize_symbol
+
+IMPORT_LOG_FILE = "imported_fills.txt"
+IMPORT_CHUNK_SIZE = 5000
+
+# Imported fills carry no stop; use the calculator's default -8%
+IMPORT_STOP_LOSS_PCT = 8.0
+IMPORT_STRATEGY = "Import"
+IMPORT_TREND_SCORE = 3
+
+# Accepted column names (Kiwoom export headers first)
+FILL_COLUMNS = {
+    "Date": ["체결일자", "주문일자", "일자", "거래일자", "Date"],
+    "Symbol": ["종목코드", "종목번호", "Symbol", "Code"],
+    "Side": ["매매구분", "매도수구분", "구분", "Side"],
+    "Quantity": ["체결수량", "수량", "Quantity", "Qty"],
+    "Price": ["체결단가", "체결가", "단가", "Price"],
+    "FillID": ["체결번호", "주문번호", "FillID", "OrderNo"],
+}
+
+
+class ImportResult:
+    """Outcome of import_fills (also the dry-run preview)."""
+    def __init__(self, trades, fills, duplicates, unmatched, updates=None, committed=False):
+        self.trades = trades          # DataFrame of journal rows (TradeID not yet assigned on dry run)
+        self.updates = updates or {}  # {TradeID: cells} for open trades of earlier imports sold here
+        self.fills = fills            # Number of fills read
+        self.duplicates = duplicates  # Fills skipped as already imported / repeated
+        self.unmatched = unmatched    # Sell fills (shares) with no open lot to close
+        self.committed = committed
+
+    @property
+    def closed_count(self):
+        closed = int((self.trades['Status'] == "Closed").sum()) if not self.trades.empty else 0
+        return closed + sum(1 for cells in self.updates.values() if cells.get('Status') == "Closed")
+
+    @property
+    def open_count(self):
+        return int((self.trades['Status'] == "Open").sum()) if not self.trades.empty else 0
+
+
+def _detect_encoding(source):
+    # Kiwoom exports are usually CP949; fall back to it when UTF-8 fails
+    if hasattr(source, "read"):
+        pos = source.tell()
+        head = source.read(65536)
+        source.seek(pos)
+    else:
+        with open(source, "rb") as f:
+            head = f.read(65536)
+    if isinstance(head, str):
+        return None
+    try:
+        head.decode("utf-8-sig")
+        return "utf-8-sig"
+    except UnicodeDecodeError as e:
+        # A multi-byte character cut at the sniff boundary is still UTF-8
+        return "utf-8-sig" if e.start >= len(head) - 3 else "cp949"
+
+
+def _resolve_columns(header):
+    mapping = {}
+    for field, candidates in FILL_COLUMNS.items():
+        for name in candidates:
+            if name in header:
+                mapping[name] = field
+                break
+        else:
+            if field != "FillID":
+                raise ValueError(f"Fill export is missing a {field} column (expected one of {candidates})")
+    return mapping
+
+
+def _normalize_side(values):
+    text = values.astype(str).str.strip().str.lower()
+    side = pd.Series(None, index=values.index, dtype=object)
+    side[text.str.contains("매수") | text.str.startswith("buy") | (text == "b")] = "BUY"
+    side[text.str.contains("매도") | text.str.startswith("sell") | (text == "s")] = "SELL"
+    return side
+
+
+def read_fills(source, chunksize=IMPORT_CHUNK_SIZE, encoding=None):
+    """
+    Streams a fill export as normalized chunks with columns
+    Date (YYYY-MM-DD), Symbol, Side (BUY/SELL), Quantity, Price, FillKey.
+    Rows that can't be parsed are dropped.
+    """
+    encoding = encoding or _detect_encoding(source)
+    reader = pd.read_csv(source, chunksize=chunksize, dtype=str, encoding=encoding, thousands=",")
+    mapping = None
+    occurrences = {}
+    for chunk in reader:
+        if mapping is None:
+            mapping = _resolve_columns(set(chunk.columns))
+        chunk = chunk[list(mapping)].rename(columns=mapping)
+
+        fills = pd.DataFrame({
+            "Date": pd.to_datetime(chunk['Date'].str.strip(), errors='coerce').dt.strftime("%Y-%m-%d"),
+            # Kiwoom prefixes KRX codes with "A" (A005930)
+            "Symbol": chunk['Symbol'].astype(str).str.strip().str.replace(r"^A(?=\d{6}$)", "", regex=True).map(normalize_symbol),
+            "Side": _normalize_side(chunk['Side']),
+            "Quantity": pd.to_numeric(chunk['Quantity'].str.replace(",", ""), errors='coerce'),
+            "Price": pd.to_numeric(chunk['Price'].str.replace(",", ""), errors='coerce'),
+        })
+        if "FillID" in chunk:
+            fills['FillID'] = chunk['FillID'].astype(str).str.strip()
+        fills = fills.dropna(subset=["Date", "Side", "Quantity", "Price"])
+        fills = fills[fills['Quantity'] > 0]
+
+        # Stable key per fill. With a fill ID column, a repeated ID is a duplicate;
+        # without one, identical rows are numbered so genuine repeats survive.
+        has_id = 'FillID' in fills
+        keys = []
+        for r in fills.itertuples(index=False):
+            base = f"{r.Date}|{r.Symbol}|{r.Side}|{r.Quantity:g}|{r.Price:g}"
+            if has_id:
+                base = f"{base}|{r.FillID}"
+            else:
+                n = occurrences.get(base, 0)
+                occurrences[base] = n + 1
+                base = f"{base}|#{n}"
+            keys.append(hashlib.sha1(base.encode()).hexdigest()[:16])
+        fills['FillKey'] = keys
+        yield fills.drop(columns=["FillID"], errors="ignore")
+
+
+def load_import_log(path=IMPORT_LOG_FILE):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return set(line.strip() for line in f if line.strip())
+    except FileNotFoundError:
+        return set()
+
+
+def _chronological(chunks):
+    """
+    Yields fill chunks oldest first. The order is detected from the first
+    chunk; a newest-first export (Kiwoom's default) is spilled to a temp
+    directory chunk by chunk and replayed in reverse, so memory stays at
+    one chunk either way.
+    """
+    chunks = iter(chunks)
+    first = next((fills for fills in chunks if not fills.empty), None)
+    if first is None:
+        return
+    if first['Date'].iloc[0] <= first['Date'].iloc[-1]:
+        yield first
+        yield from chunks
+        return
+    with tempfile.TemporaryDirectory(prefix="fills_") as tmp:
+        count = 0
+        for fills in itertools.chain([first], chunks):
+            fills.to_pickle(os.path.join(tmp, f"{count}.pkl"))
+            count += 1
+        for n in reversed(range(count)):
+            # Reversed row by row too, so same-day fills keep their real order
+            yield pd.read_pickle(os.path.join(tmp, f"{n}.pkl")).iloc[::-1]
+
+
+def pair_fills(chunks, account_id, seen=None, open_trades=None):
+    """
+    FIFO-pairs streamed fills into journal rows.
+    Each sell closes shares from the oldest open lots of the same symbol; a
+    partially sold lot yields one closed row per sell plus an open row for
+    the remainder. `open_trades` (open rows of earlier imports) are the oldest
+    lots: selling one closes or shrinks that row in place instead.
+    Returns (trades DataFrame, fill count, duplicates, unmatched, fill keys, updates).
+    """
+    seen = set() if seen is None else seen
+    lots = {}          # symbol -> deque of [remaining_qty, entry_price, entry_date, trade_id, stop_loss]
+    closed = []        # (symbol, entry_date, entry_price, qty, exit_date, exit_price)
+    closes = {}        # trade_id -> (qty, exit_date, exit_price) for seeded lots sold out
+    new_keys = []
+    fill_count = duplicates = unmatched = 0
+    last_date = None
+
+    seeded = {}
+    if open_trades is not None and not open_trades.empty:
+        for r in open_trades.sort_values(["EntryDate", "TradeID"], kind="stable").itertuples(index=False):
+            lot = [int(r.Quantity), float(r.EntryPrice), pd.Timestamp(r.EntryDate).strftime("%Y-%m-%d"),
+                   int(r.TradeID), float(r.StopLoss)]
+            lots.setdefault(str(r.Symbol), deque()).append(lot)
+            seeded[lot[3]] = lot[:]
+
+    for fills in _chronological(chunks):
+        fills = fills.sort_values("Date", kind="stable")
+        if not fills.empty:
+            if last_date is not None and fills['Date'].iloc[0] < last_date:
+                raise ValueError("Fill export must be sorted by date (oldest or newest first)")
+            last_date = fills['Date'].iloc[-1]
+
+        for r in fills.itertuples(index=False):
+            fill_count += 1
+            if r.FillKey in seen:
+                duplicates += 1
+                continue
+            seen.add(r.FillKey)
+            new_keys.append(r.FillKey)
+
+            queue = lots.setdefault(r.Symbol, deque())
+            if r.Side == "BUY":
+                queue.append([r.Quantity, r.Price, r.Date, None, None])
+                continue
+
+            remaining = r.Quantity
+            while remaining > 0 and queue:
+                lot = queue[0]
+                take = min(lot[0], remaining)
+                if lot[3] is not None and take == lot[0]:
+                    # The journal row of an earlier import becomes the closed row
+                    closes[lot[3]] = (take, r.Date, r.Price)
+                else:
+                    closed.append((r.Symbol, lot[2], lot[1], take, r.Date, r.Price))
+                lot[0] -= take
+                remaining -= take
+                if lot[0] == 0:
+                    queue.popleft()
+            if remaining > 0:
+                unmatched += remaining
+
+    open_rows = [(sym, lot[2], lot[1], lot[0]) for sym, queue in lots.items() for lot in queue if lot[3] is None]
+    resized = {lot[3]: lot[0] for queue in lots.values() for lot in queue
+               if lot[3] is not None and lot[0] != seeded[lot[3]][0]}
+    updates = _seeded_updates(seeded, closes, resized)
+    return _to_trades(closed, open_rows, account_id), fill_count, duplicates, unmatched, new_keys, updates
+
+
+def _seeded_updates(seeded, closes, resized):
+    # Cells to write on the open trades of earlier imports ({TradeID: cells})
+    updates = {}
+    for trade_id, qty in resized.items():
+        entry, stop = seeded[trade_id][1], seeded[trade_id][4]
+        updates[trade_id] = {'Quantity': qty, 'UnitQuantity': qty // 3,
+                             'RiskAmount': int(qty * abs(entry - stop))}
+    if closes:
+        ids = list(closes)
+        pnl = calculate_pnl([seeded[t][1] for t in ids], [closes[t][0] for t in ids],
+                            [closes[t][2] for t in ids], [seeded[t][4] for t in ids])
+        for trade_id, p in zip(ids, pnl.itertuples(index=False)):
+            qty, exit_date, exit_price = closes[trade_id]
+            entry, stop = seeded[trade_id][1], seeded[trade_id][4]
+            updates[trade_id] = {'Quantity': qty, 'UnitQuantity': qty // 3,
+                                 'RiskAmount': int(qty * abs(entry - stop)),
+                                 'Status': "Closed", 'ExitDate': exit_date, 'ExitPrice': float(exit_price),
+                                 'PnL': float(p.NetPnL), 'R_Multiple': round(float(p.R_Multiple), 2)}
+    return updates
+
+
+def _to_trades(closed, open_rows, account_id):
+    closed_df = pd.DataFrame(closed, columns=["Symbol", "EntryDate", "EntryPrice", "Quantity", "ExitDate", "ExitPrice"])
+    open_df = pd.DataFrame(open_rows, columns=["Symbol", "EntryDate", "EntryPrice", "Quantity"])
+    open_df['ExitDate'] = ""
+    open_df['ExitPrice'] = 0.0
+
+    parts = [df for df in (closed_df, open_df) if not df.empty]
+    if not parts:
+        return closed_df
+    trades = pd.concat(parts, ignore_index=True)
+
+    trades['Status'] = ["Closed"] * len(closed_df) + ["Open"] * len(open_df)
+    trades['AccountID'] = account_id
+    trades['Strategy'] = IMPORT_STRATEGY
+    trades['TrendScore'] = IMPORT_TREND_SCORE
+    trades['StopLoss'] = trades['EntryPrice'] * (1 - IMPORT_STOP_LOSS_PCT / 100.0)
+    trades['Quantity'] = trades['Quantity'].astype(int)
+    trades['UnitQuantity'] = trades['Quantity'] // 3
+    trades['RiskAmount'] = (trades['Quantity'] * (trades['EntryPrice'] - trades['StopLoss']).abs()).astype(int)
+
+    # Fee model on all closed rows at once
+    is_closed = trades['Status'] == "Closed"
+    pnl = calculate_pnl(trades['EntryPrice'], trades['Quantity'], trades['ExitPrice'], trades['StopLoss'])
+    trades['PnL'] = pnl['NetPnL'].where(is_closed, 0.0)
+    trades['R_Multiple'] = pnl['R_Multiple'].round(2).where(is_closed, 0.0)
+
+    return trades.sort_values(["EntryDate", "ExitDate"], kind="stable").reset_index(drop=True)
+
+
+def import_fills(tm, account_id, source, dry_run=False, chunksize=IMPORT_CHUNK_SIZE,
+                 encoding=None, log_path=IMPORT_LOG_FILE):
+    """
+    Imports a broker fill export into `account_id`.
+    With dry_run=True nothing is written; the result is a preview.
+    Otherwise all trades and the account's realized P&L are committed in one batch,
+    and the fill keys are recorded so re-importing the same file is a no-op.
+    Open trades of earlier imports into the account are closed or shrunk by
+    the sells in this export.
+    """
+    seen = load_import_log(log_path)
+    open_trades = tm.get_trades(account_id=account_id, status="Open", strategies=IMPORT_STRATEGY)
+    trades, fill_count, duplicates, unmatched, new_keys, updates = pair_fills(
+        read_fills(source, chunksize=chunksize, encoding=encoding), account_id, seen, open_trades)
+    result = ImportResult(trades, fill_count, duplicates, unmatched, updates)
+    if dry_run or (trades.empty and not updates):
+        return result
+
+    with tm.batch():
+        ids = tm.add_trades(trades)
+        # update_trade books the P&L of the trades it closes
+        for trade_id, cells in updates.items():
+            tm.update_trade(trade_id, cells)
+        realized = float(trades.loc[trades['Status'] == "Closed", 'PnL'].sum()) if not trades.empty else 0.0
+        if realized:
+            tm.update_account_balance(account_id, realized)
+
+    with open(log_path, "a", encoding="utf-8") as f:
+        f.write("".join(k + "\n" for k in new_keys))
+
+    result.trades = trades.assign(TradeID=ids)
+    result.committed = True
+    return result
@@ -0,0 +1,135 @@
+"""
+End-of-day mark-to-market snapshots.
+
+Values every open position of every account with one batched quote refresh
+and the journal's fee model, and writes dated files to SNAPSHOT_DIR:
+
+    positions_YYYY-MM-DD.csv   one row per open trade
+    accounts_YYYY-MM-DD.csv    one row per account (NAV, unrealized P&L)
+
+Meant to run unattended after the close (journal_cli.py eod-snapshot);
+the dashboard reads the files instead of valuing positions live.
+"""
+import glob
+import os
+import re
+
+import pandas as pd
+
+from trade_logic import last_trading_day
+
+SNAPSHOT_DIR = "snapshots"
+
+POSITION_COLUMNS = [
+    "Date", "AccountID", "TradeID", "Symbol", "Name", "Quantity", "EntryPrice", "StopLoss",
+    "CurrentPrice", "HasQuote", "EntryAmount", "MarkAmount", "Fee", "UnrealizedPnL", "R_Multiple",
+]
+ACCOUNT_SNAPSHOT_COLUMNS = [
+    "Date", "AccountID", "Name", "Positions", "Unquoted", "RealizedBalance", "Invested", "Cash",
+    "MarketValue", "UnrealizedPnL", "NAV",
+]
+
+
+def build_snapshot(tm, as_of=None):
+    """Returns (positions, accounts) DataFrames valued at the latest close."""
+    as_of = (as_of or last_trading_day()).strftime("%Y-%m-%d")
+    accounts = tm.get_accounts()
+    trades = tm.get_trades(status="Open")
+
+    if trades.empty:
+        positions = pd.DataFrame(columns=POSITION_COLUMNS)
+    else:
+        # One parallel refresh for every distinct symbol, then one vectorized valuation
+        prices = tm.refresh_quotes(trades['Symbol'].unique())
+        valuation = tm.value_positions(trades, prices)
+        names = tm.get_stock_names(trades['Symbol'].unique())
+        positions = pd.DataFrame({
+            "Date": as_of,
+            "AccountID": trades['AccountID'].astype(str),
+            "TradeID": trades['TradeID'].astype(int),
+            "Symbol": trades['Symbol'],
+            "Name": trades['Symbol'].map(names),
+            "Quantity": trades['Quantity'].astype(int),
+            "EntryPrice": trades['EntryPrice'],
+            "StopLoss": trades['StopLoss'],
+            "CurrentPrice": valuation['CurrentPrice'],
+            "HasQuote": valuation['HasQuote'],
+            "EntryAmount": valuation['EntryAmount'],
+            "MarkAmount": valuation['MarkAmount'],
+            "Fee": valuation['Fee'],
+            "UnrealizedPnL": valuation['NetPnL'],
+            "R_Multiple": valuation['R_Multiple'].round(2),
+        })[POSITION_COLUMNS].reset_index(drop=True)
+
+    per_account = positions.groupby("AccountID").agg(
+        Positions=("TradeID", "size"),
+        Unquoted=("HasQuote", lambda s: int((~s.astype(bool)).sum())),
+        Invested=("EntryAmount", "sum"),
+        MarketValue=("MarkAmount", "sum"),
+        UnrealizedPnL=("UnrealizedPnL", "sum"),
+    )
+    summary = pd.DataFrame({
+        "AccountID": accounts['AccountID'].astype(str),
+        "RealizedBalance": pd.to_numeric(accounts['CurrentBalance'], errors='coerce').fillna(0.0),
+    }).set_index("AccountID").join(per_account).fillna(0)
+    summary['Date'] = as_of
+    summary['Name'] = summary.index.map(tm.get_account_names())
+    summary['Cash'] = summary['RealizedBalance'] - summary['Invested']
+    summary['NAV'] = summary['RealizedBalance'] + summary['UnrealizedPnL']
+    summary = summary.reset_index()
+    summary[['Positions', 'Unquoted']] = summary[['Positions', 'Unquoted']].astype(int)
+    return positions, summary[ACCOUNT_SNAPSHOT_COLUMNS]
+
+
+def _write_csv(df, path):
+    tmp_path = path + ".tmp"
+    df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def write_snapshot(positions, accounts, root=SNAPSHOT_DIR):
+    """Writes both files for the snapshot's date (overwriting a rerun of the same day)."""
+    os.makedirs(root, exist_ok=True)
+    date = accounts['Date'].iloc[0] if not accounts.empty else last_trading_day().strftime("%Y-%m-%d")
+    paths = (os.path.join(root, f"positions_{date}.csv"), os.path.join(root, f"accounts_{date}.csv"))
+    _write_csv(positions, paths[0])
+    _write_csv(accounts, paths[1])
+    return paths
+
+
+def run_eod(tm, as_of=None, root=SNAPSHOT_DIR):
+    positions, accounts = build_snapshot(tm, as_of)
+    paths = write_snapshot(positions, accounts, root)
+    return positions, accounts, paths
+
+
+def snapshot_dates(root=SNAPSHOT_DIR):
+    dates = []
+    for path in glob.glob(os.path.join(root, "accounts_*.csv")):
+        m = re.search(r"accounts_(\d{4}-\d{2}-\d{2})\.csv$", path)
+        if m:
+            dates.append(m.group(1))
+    return sorted(dates)
+
+
+def load_snapshot(date=None, root=SNAPSHOT_DIR):
+    """(positions, accounts) for `date` (default: latest), or (None, None) if there is none."""
+    dates = snapshot_dates(root)
+    if date is None:
+        if not dates:
+            return None, None
+        date = dates[-1]
+    try:
+        positions = pd.read_csv(os.path.join(root, f"positions_{date}.csv"), dtype={"AccountID": str, "Symbol": str})
+        accounts = pd.read_csv(os.path.join(root, f"accounts_{date}.csv"), dtype={"AccountID": str})
+    except FileNotFoundError:
+        return None, None
+    return positions, accounts
+
+
+def load_nav_history(root=SNAPSHOT_DIR):
+    """All account snapshot rows, oldest first (Date, AccountID, NAV, ...)."""
+    frames = [pd.read_csv(os.path.join(root, f"accounts_{d}.csv"), dtype={"AccountID": str}) for d in snapshot_dates(root)]
+    if not frames:
+        return pd.DataFrame(columns=ACCOUNT_SNAPSHOT_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
@@ -1,9 +1,15 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
-import plotly.express as px
-import math
 from trade_logic import TradeManager
+from profiling import PROFILER, PROFILE_BACKGROUND_TAG
+from broker_import import import_fills
+from eod_snapshot import load_nav_history, snapshot_dates
 from datetime import datetime
+import uuid
+
+# Live positions panel: refresh interval choices (seconds)
+LIVE_REFRESH_INTERVALS = [5, 10, 30, 60]
 
 # --- PAGE CONFIG ---
 st.set_page_config(
@@ -30,18 +36,46 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # --- INITIALIZE ---
-if 'tm' not in st.session_state:
-    st.session_state.tm = TradeManager()
+@st.cache_resource
+def get_trade_manager():
+    # One manager per process, shared by every session (connects and runs init_files once)
+    manager = TradeManager()
+    manager.start_quote_prefetcher()
+    return manager
+
+tm = get_trade_manager()
+
+@st.cache_data
+def load_nav_history_cached(dates):
+    # Keyed by the snapshot dates present, so a new EOD run shows up on the next rerun
+    return load_nav_history()
 
-tm = st.session_state.tm
+# Developer panel: ?dev=1 (or JOURNAL_PROFILE=1) shows per-rerun instrumentation in the sidebar
+show_dev_panel = PROFILER.enabled or st.query_params.get("dev") == "1"
+if "dev_session" not in st.session_state:
+    st.session_state.dev_session = uuid.uuid4().hex[:8]
+st.session_state.dev_rerun = st.session_state.get("dev_rerun", 0) + 1
+# Background (prefetcher) events are shown from this session's previous run onward
+background_since = st.session_state.get("dev_background_mark", 0)
+st.session_state.dev_background_mark = PROFILER.mark()
+rerun_started = datetime.now()
+
+def activate_profiler():
+    # The checkbox profiles this session only; its events carry the session/rerun ids
+    PROFILER.activate(st.session_state.get("dev_profile", False),
+                      session=st.session_state.dev_session, rerun=st.session_state.dev_rerun)
+
+activate_profiler()
 
 # --- SIDEBAR: ACCOUNT MANAGMENT ---
 st.sidebar.title("💼 계좌 관리 (Account)")
 
 accounts = tm.get_accounts()
-account_names = accounts['AccountID'].tolist() if not accounts.empty else []
+# Widgets select the stable AccountID and show the display name
+account_names = tm.get_account_names()
+account_ids = list(account_names)
 
-selected_account = st.sidebar.selectbox("계좌 선택", account_names)
+selected_account = st.sidebar.selectbox("계좌 선택", account_ids, format_func=account_names.get)
 
 with st.sidebar.expander("➕ 새 계좌 추가"):
     new_acc_name = st.text_input("계좌명 (예: 키움증권)")
@@ -55,22 +89,22 @@ with st.sidebar.expander("➕ 새 계좌 추가"):
         else:
             st.error(msg)
     
-    if len(account_names) == 0:
+    if len(account_ids) == 0:
         st.sidebar.warning("⚠️ 먼저 계좌를 생성해주세요!")
 
     # Account Management (Edit/Delete)
     with st.sidebar.expander("⚙️ 계좌 관리 (Edit/Del)"):
-        if len(account_names) > 0:
-            target_acc = st.selectbox("관리할 계좌", account_names, key='manage_acc')
+        if len(account_ids) > 0:
+            target_acc = st.selectbox("관리할 계좌", account_ids, format_func=account_names.get, key='manage_acc')
             
             # Get current info
-            curr_man_row = accounts[accounts['AccountID'] == target_acc].iloc[0]
+            curr_man_row = accounts[accounts['AccountID'].astype(str) == target_acc].iloc[0]
             
             man_tab1, man_tab2 = st.tabs(["수정", "삭제"])
             
             with man_tab1:
                 with st.form("edit_acc_form"):
-                    edit_name = st.text_input("계좌명 수정", value=curr_man_row['AccountID'])
+                    edit_name = st.text_input("계좌명 수정", value=curr_man_row['Name'])
                     edit_bal = st.number_input("잔고 수정", value=float(curr_man_row['CurrentBalance']))
                     if st.form_submit_button("수정 저장"):
                         succ, msg = tm.update_account(target_acc, edit_name, edit_bal)
@@ -84,18 +118,18 @@ with st.sidebar.expander("➕ 새 계좌 추가"):
                 st.warning("계좌를 삭제하면? (주의)")
                 if st.button("🗑️ 계좌 삭제 확인"):
                     tm.delete_account(target_acc)
-                    st.success(f"{target_acc} 삭제됨")
+                    st.success(f"{account_names[target_acc]} 삭제됨")
                     st.rerun()
         else:
             st.info("관리할 계좌가 없습니다.")
 
 acc_row = None
 if selected_account:
-    acc_row = accounts[accounts['AccountID'] == selected_account].iloc[0]
+    acc_row = accounts[accounts['AccountID'].astype(str) == selected_account].iloc[0]
     current_balance = float(acc_row['CurrentBalance'])
     
     # Calculate Invested Amount (Active Trades)
-    active_trades = tm.get_trades(selected_account, "Open")
+    active_trades = tm.get_trades(selected_account, "Open", columns=["EntryPrice", "Quantity"])
     invested_amt = 0.0
     if not active_trades.empty:
         invested_amt = (active_trades['EntryPrice'] * active_trades['Quantity']).sum()
@@ -108,13 +142,35 @@ if selected_account:
     st.sidebar.metric("계좌 총 잔고 (Total)", f"₩{int(current_balance):,}")
     st.sidebar.caption(f"증권사: {acc_row['Broker']}")
 
+# --- SHEETS SYNC STATUS (JOURNAL_BACKEND=sync) ---
+sync = tm.sync_status()
+if sync is not None:
+    last_sync = datetime.fromtimestamp(sync['last_sync']).strftime('%H:%M:%S') if sync['last_sync'] else "-"
+    st.sidebar.caption(f"☁️ 시트 동기화: 대기 {sync['pending']}건 · 마지막 {last_sync}")
+    if sync['last_error']:
+        st.sidebar.caption(f"⚠️ 동기화 오류 (재시도 예정): {sync['last_error']}")
+    if not sync['conflicts'].empty:
+        with st.sidebar.expander(f"⚠️ 동기화 충돌 {len(sync['conflicts'])}건"):
+            for c in sync['conflicts'].itertuples(index=False):
+                table_label = "매매" if c.tbl == "trades.csv" else "계좌"
+                st.markdown(f"**{table_label} {c.key}**")
+                st.caption(f"로컬: {c.local}")
+                st.caption(f"시트: {c.remote}")
+                r1, r2 = st.columns(2)
+                if r1.button("로컬 유지", key=f"sync_keep_local_{c.tbl}_{c.key}"):
+                    tm.resolve_sync_conflict(c.tbl, c.key, "local")
+                    st.rerun()
+                if r2.button("시트 유지", key=f"sync_keep_remote_{c.tbl}_{c.key}"):
+                    tm.resolve_sync_conflict(c.tbl, c.key, "remote")
+                    st.rerun()
+
 # --- MAIN CONTENT ---
 st.title("📈 추세 추종 매매일지")
 
 tab1, tab2, tab3 = st.tabs(["🧮 리스크 계산기 & 기록", "🏁 진행 중인 매매", "📊 매매 통계"])
 
 # === TAB 1: CALCULATOR ===
-with tab1:
+with tab1, PROFILER.span("render.calculator"):
     col1, col2 = st.columns([1, 2])
     
     # --- INPUT SECTION ---
@@ -129,6 +185,8 @@ with tab1:
             stock_name = tm.get_stock_name(symbol)
             if stock_name:
                 st.caption(f"🏷️ 종목명: **{stock_name}**")
+            elif not tm.stock_listing_ready():
+                st.caption("⏳ 종목 목록을 불러오는 중입니다...")
             else:
                 st.caption("⚠️ 종목명을 찾을 수 없습니다.")
 
@@ -193,6 +251,32 @@ with tab1:
                 """, unsafe_allow_html=True)
             else:
                 st.warning("⚠️ 진입가와 손절가가 같을 수 없습니다.")
+            
+            # What-if grid: every stop % x risk % combination sized in one vectorized call
+            with st.expander("🗺️ What-if 시나리오 (손절폭 x 리스크 히트맵)"):
+                w1, w2, w3 = st.columns(3)
+                sl_range = w1.slider("손절 비율 범위 (-%)", 0.5, 20.0, (2.0, 15.0), 0.5, key="wi_sl")
+                risk_range = w2.slider("리스크 비율 범위 (%)", 0.5, 5.0, (0.5, 5.0), 0.5, key="wi_risk")
+                wi_metric = w3.selectbox("표시 값", ["매수 수량", "필요 자금", "리스크 금액"], key="wi_metric")
+                hide_over = st.checkbox("예수금 초과 시나리오 숨기기", value=True, key="wi_hide")
+                
+                grid = tm.calculate_position_grid(
+                    current_cap, [entry_price],
+                    np.arange(sl_range[0], sl_range[1] + 0.25, 0.5),
+                    np.arange(risk_range[0], risk_range[1] + 0.25, 0.5),
+                    [trend_option], deposit=deposit,
+                )
+                value_col = {"매수 수량": "TotalQty", "필요 자금": "CapitalRequired", "리스크 금액": "RiskAmount"}[wi_metric]
+                values = grid[value_col].astype(float).where(grid['Fits'] | (not hide_over))
+                matrix = grid.assign(Value=values).pivot(index="RiskPct", columns="StopLossPct", values="Value")
+                
+                import plotly.express as px  # deferred: heavy import, only needed once the grid is shown
+                fig = px.imshow(
+                    matrix, aspect="auto", origin="lower", color_continuous_scale="Viridis", text_auto=",.0f",
+                    labels={"x": "손절 비율 (-%)", "y": "리스크 비율 (%)", "color": wi_metric},
+                )
+                st.plotly_chart(fig, use_container_width=True)
+                st.caption(f"{len(grid):,}개 시나리오 · 예수금 ₩{int(deposit):,} 이내: {int(grid['Fits'].sum()):,}개")
         
         st.write("---")
         st.subheader("3. 매매 기록 확정 (Confirm)")
@@ -226,149 +310,181 @@ with tab1:
                     st.success(f"매매가 기록되었습니다! ({record_date.strftime('%Y-%m-%d')}, {symbol}, {record_qty}주)")
                 else:
                     st.error("계좌 선택, 가격 입력, 매수 수량 > 0 이어야 합니다.")
+        
+        # Bulk import of broker fills (Kiwoom-style CSV export)
+        with st.expander("📥 체결내역 일괄 가져오기 (CSV)"):
+            fills_file = st.file_uploader("증권사 체결내역 CSV", type=["csv"], key="fills_upload")
+            if fills_file is not None and not selected_account:
+                st.warning("👈 가져올 계좌를 먼저 선택해주세요.")
+            elif fills_file is not None:
+                try:
+                    # Dry run first: preview what would be written
+                    preview = import_fills(tm, selected_account, fills_file, dry_run=True)
+                except ValueError as e:
+                    st.error(f"가져오기 실패: {e}")
+                else:
+                    p1, p2, p3, p4 = st.columns(4)
+                    p1.metric("체결 건수", f"{preview.fills:,}")
+                    p2.metric("청산 매매", f"{preview.closed_count:,}")
+                    p3.metric("보유 포지션", f"{preview.open_count:,}")
+                    p4.metric("중복 체결 (제외)", f"{preview.duplicates:,}")
+                    if preview.unmatched:
+                        st.caption(f"⚠️ 매수 내역 없이 매도된 {int(preview.unmatched):,}주는 제외됩니다.")
+                    st.dataframe(preview.trades.head(50), use_container_width=True)
+                    
+                    if preview.updates:
+                        st.caption(f"🔁 이전에 가져온 보유 포지션 {len(preview.updates):,}건이 청산/수량 변경됩니다.")
+                    n_changes = len(preview.trades) + len(preview.updates)
+                    if st.button(f"💾 {n_changes:,}건 일지에 저장", disabled=n_changes == 0):
+                        fills_file.seek(0)
+                        result = import_fills(tm, selected_account, fills_file)
+                        st.success(f"{len(result.trades) + len(result.updates):,}건의 매매가 기록되었습니다.")
+                        st.rerun()
 
 # === TAB 2: ACTIVE TRADES ===
-# === TAB 2: ACTIVE TRADES ===
-with tab2:
-    col_header, col_btn = st.columns([4, 1])
-    col_header.subheader("보유 중인 포지션")
-    if col_btn.button("🔄 시세 갱신"):
-        st.cache_data.clear()
-        st.rerun()
-
-    if selected_account:
-        open_trades = tm.get_trades(selected_account, "Open")
+def render_positions(open_trades, live_interval=None):
+    """
+    Totals, marks and per-position cards for `open_trades`. Runs as a fragment:
+    in live mode it re-renders by itself from the prefetched quote snapshot,
+    reusing the trades passed in by the last full run instead of re-querying.
+    """
+    activate_profiler()
+    with PROFILER.span("render.positions"):
+        # --- 1. TOTAL SUMMARY (Active) ---
+        # Marks from the background prefetch snapshot, fees/PnL computed for all rows at once (Kiwoom fee model)
+        prices, quotes_as_of = tm.get_quote_snapshot(open_trades['Symbol'])
+        valuation = tm.value_positions(open_trades, prices)
+        if not open_trades['Symbol'].isin(list(prices)).all():
+            st.caption("⏳ 일부 종목의 시세를 불러오는 중입니다. 잠시 후 새로고침 해주세요.")
+        elif quotes_as_of is not None:
+            live_note = f"🟢 실시간 ({live_interval}초 주기) · " if live_interval else ""
+            st.caption(f"{live_note}시세 기준: {quotes_as_of.strftime('%H:%M:%S')}")
         
-        if not open_trades.empty:
-            # --- 1. TOTAL SUMMARY (Active) ---
-            total_eval_amt = 0
-            total_net_pnl = 0
-            total_fee = 0
-            
-            # Pre-calculate totals
-            # Note: We need to fetch prices for all to get accurate total
-            # For performance, we might want to optimize this, but loop is fine for small N
+        total_eval_amt = valuation['MarkAmount'].sum()
+        total_net_pnl = valuation['NetPnL'].sum()
+        total_fee = valuation['Fee'].sum()
+        
+        # Display Total Summary
+        s1, s2, s3 = st.columns(3)
+        s1.metric("총 평가 금액", f"₩{int(total_eval_amt):,}")
+        s2.metric("예상 수수료 (세금+0.015%)", f"₩{int(total_fee):,}")
+        s3.metric("총 평가 손익 (Net)", f"₩{int(total_net_pnl):,}", 
+                  delta_color="normal" if total_net_pnl == 0 else "inverse")
+        
+        # Close all at market (one batched write for every position)
+        with st.expander("⚡ 전체 시장가 청산"):
+            quoted = valuation[valuation['HasQuote']]
+            st.caption(f"현재가 기준으로 {len(quoted)}개 포지션을 한 번에 청산합니다.")
+            if len(quoted) < len(valuation):
+                st.caption(f"⚠️ 현재가가 없는 {len(valuation) - len(quoted)}개 포지션은 제외됩니다.")
+            if st.button("⚡ 전체 청산 확인", key="btn_close_all", disabled=quoted.empty):
+                exit_prices = dict(zip(open_trades.loc[quoted.index, 'TradeID'], quoted['CurrentPrice']))
+                closed = tm.close_trades(exit_prices)
+                st.success(f"{len(closed)}개 포지션 청산 완료!")
+                st.rerun()
+        
+        st.divider()
+
+        # --- 2. TRADE LIST ---
+        for i, row in open_trades.iterrows():
+            # Pre-calculated valuation (same index as open_trades)
+            data = valuation.loc[i]
+            curr_price = float(data['CurrentPrice'])
+            net_pnl = data['NetPnL']
+            fee = data['Fee']
             
-            summary_data = []
+            stock_name = tm.get_stock_name(row['Symbol'])
+            title_label = f"{stock_name} ({row['Symbol']})" if stock_name else row['Symbol']
             
-            for idx, row in open_trades.iterrows():
-                curr_price = tm.fetch_current_price(row['Symbol'])
-                curr_price = float(curr_price) if curr_price else float(row['EntryPrice'])
-                
-                entry_price = float(row['EntryPrice'])
-                qty = int(row['Quantity'])
-                entry_amt = entry_price * qty
-                eval_amt = curr_price * qty
-                
-                # Fee: 0.20% Tax (Sell) + 0.015% Fee (Buy & Sell)
-                # Kiwoom logic: Fee floor 10, Tax floor 1
-                buy_fee = math.floor((entry_amt * 0.00015) / 10) * 10
-                sell_fee = math.floor((eval_amt * 0.00015) / 10) * 10
-                tax = math.floor(eval_amt * 0.002)
+            entry_label = row['EntryDate'].strftime('%Y-%m-%d') if pd.notnull(row['EntryDate']) else '-'
+            with st.expander(f"{title_label} - {entry_label} (PnL: ₩{int(net_pnl):,})", expanded=True):
                 
-                fee = buy_fee + sell_fee + tax
+                tc1, tc2, tc3, tc4 = st.columns([1.5, 1.2, 1.5, 1.2]) 
                 
-                gross_pnl = eval_amt - entry_amt
-                net_pnl = gross_pnl - fee
-                
-                total_eval_amt += eval_amt
-                total_net_pnl += net_pnl
-                total_fee += fee
+                entry_price = float(row['EntryPrice'])
+                sl = float(row['StopLoss'])
                 
-                summary_data.append({
-                    "TradeID": row['TradeID'],
-                    "CurrentPrice": curr_price,
-                    "NetPnL": net_pnl,
-                    "Fee": fee
-                })
-            
-            # Display Total Summary
-            s1, s2, s3 = st.columns(3)
-            s1.metric("총 평가 금액", f"₩{int(total_eval_amt):,}")
-            s2.metric("예상 수수료 (세금+0.015%)", f"₩{int(total_fee):,}")
-            s3.metric("총 평가 손익 (Net)", f"₩{int(total_net_pnl):,}", 
-                      delta_color="normal" if total_net_pnl == 0 else "inverse")
-            
-            st.divider()
-
-            # --- 2. TRADE LIST ---
-            # Re-iterate or use summary_data
-            for i, row in open_trades.iterrows():
-                # Match pre-calculated data
-                data = next((item for item in summary_data if item["TradeID"] == row['TradeID']), None)
-                curr_price = data['CurrentPrice']
-                net_pnl = data['NetPnL']
-                fee = data['Fee']
+                pnl_pct = (net_pnl / data['EntryAmount']) * 100
+                r_multiple = data['R_Multiple']
                 
-                stock_name = tm.get_stock_name(row['Symbol'])
-                title_label = f"{stock_name} ({row['Symbol']})" if stock_name else row['Symbol']
+                tc1.metric("현재가", f"{curr_price:,.0f}", f"{pnl_pct:.2f}% (Net)")
+                tc2.metric("R-배수", f"{r_multiple:.2f}R", delta_color="off")
+                tc3.metric("평가 손익 (수수료후)", f"₩{int(net_pnl):,}")
                 
-                with st.expander(f"{title_label} - {row['EntryDate']} (PnL: ₩{int(net_pnl):,})", expanded=True):
-                    
-                    tc1, tc2, tc3, tc4 = st.columns([1.5, 1.2, 1.5, 1.2]) 
-                    
-                    entry_price = float(row['EntryPrice'])
-                    sl = float(row['StopLoss'])
-                    
-                    pnl_pct = (net_pnl / (entry_price * int(row['Quantity']))) * 100
-                    
-                    risk_range = abs(entry_price - sl)
-                    r_multiple = (curr_price - entry_price) / risk_range if risk_range else 0
-                    
-                    tc1.metric("현재가", f"{curr_price:,.0f}", f"{pnl_pct:.2f}% (Net)")
-                    tc2.metric("R-배수", f"{r_multiple:.2f}R", delta_color="off")
-                    tc3.metric("평가 손익 (수수료후)", f"₩{int(net_pnl):,}")
-                    
-                    # --- ACTION BUTTONS (Col 4) ---
-                    with tc4:
-                        ac1, ac2 = st.columns(2)
-                        # Toggle Edit State logic using session state
-                        edit_key = f"edit_mode_{row['TradeID']}"
-                        if ac1.button("✏️", key=f"btn_edit_{row['TradeID']}", help="수정 모드"):
-                            st.session_state[edit_key] = not st.session_state.get(edit_key, False)
+                # --- ACTION BUTTONS (Col 4) ---
+                with tc4:
+                    ac1, ac2 = st.columns(2)
+                    # Toggle Edit State logic using session state
+                    edit_key = f"edit_mode_{row['TradeID']}"
+                    if ac1.button("✏️", key=f"btn_edit_{row['TradeID']}", help="수정 모드"):
+                        st.session_state[edit_key] = not st.session_state.get(edit_key, False)
+                        st.rerun()
+                        
+                    # Close Trade (like close-all, never at the entry-price fallback of an unquoted row)
+                    if ac2.button("⚡", key=f"btn_close_{row['TradeID']}",
+                                  help="포지션 청산" if data['HasQuote'] else "현재가를 불러온 뒤 청산할 수 있습니다",
+                                  disabled=not data['HasQuote']):
+                        tm.close_trade(row['TradeID'], curr_price)
+                        st.success("청산 완료!")
+                        st.rerun()
+                        
+                # --- EDIT FORM (Conditional) ---
+                if st.session_state.get(f"edit_mode_{row['TradeID']}", False):
+                    st.info("✏️ 포지션 수정 모드")
+                    with st.form(key=f"edit_form_{row['TradeID']}"):
+                        ec1, ec2, ec3, ec4 = st.columns(4)
+                        new_entry = ec1.number_input("매수가 수정", value=entry_price)
+                        new_qty = ec2.number_input("수량 수정", value=int(row['Quantity']), step=1)
+                        new_sl = ec3.number_input("손절가 수정", value=sl)
+                        new_note = ec4.text_input("메모", value=row['Strategy'])
+                        
+                        c_btn1, c_btn2 = st.columns([1, 1])
+                        if c_btn1.form_submit_button("💾 저장"):
+                            tm.update_trade(row['TradeID'], {
+                                "EntryPrice": new_entry,
+                                "Quantity": new_qty, 
+                                "StopLoss": new_sl,
+                                "Strategy": new_note
+                            })
+                            st.session_state[f"edit_mode_{row['TradeID']}"] = False
+                            st.success("수정되었습니다.")
                             st.rerun()
                             
-                        # Close Trade
-                        if ac2.button("⚡", key=f"btn_close_{row['TradeID']}", help="포지션 청산"):
-                            tm.close_trade(row['TradeID'], curr_price)
-                            st.success("청산 완료!")
+                        if c_btn2.form_submit_button("🗑️ 삭제 (주의)"):
+                            tm.delete_trade(row['TradeID'])
+                            st.success("삭제되었습니다.")
                             st.rerun()
-                            
-                    # --- EDIT FORM (Conditional) ---
-                    if st.session_state.get(f"edit_mode_{row['TradeID']}", False):
-                        st.info("✏️ 포지션 수정 모드")
-                        with st.form(key=f"edit_form_{row['TradeID']}"):
-                            ec1, ec2, ec3, ec4 = st.columns(4)
-                            new_entry = ec1.number_input("매수가 수정", value=entry_price)
-                            new_qty = ec2.number_input("수량 수정", value=int(row['Quantity']), step=1)
-                            new_sl = ec3.number_input("손절가 수정", value=sl)
-                            new_note = ec4.text_input("메모", value=row['Strategy'])
-                            
-                            c_btn1, c_btn2 = st.columns([1, 1])
-                            if c_btn1.form_submit_button("💾 저장"):
-                                tm.update_trade(row['TradeID'], {
-                                    "EntryPrice": new_entry,
-                                    "Quantity": new_qty, 
-                                    "StopLoss": new_sl,
-                                    "Strategy": new_note
-                                })
-                                st.session_state[f"edit_mode_{row['TradeID']}"] = False
-                                st.success("수정되었습니다.")
-                                st.rerun()
-                                
-                            if c_btn2.form_submit_button("🗑️ 삭제 (주의)"):
-                                tm.delete_trade(row['TradeID'])
-                                st.success("삭제되었습니다.")
-                                st.rerun()
-
-                    # Progress Bar
-                    progress_val = min(max((r_multiple + 1.0) / 4.0, 0.0), 1.0)
-                    st.progress(progress_val)
-                    
-                    st.caption(f"진입: {entry_price:,.0f} | 손절: {sl:,.0f} | 리스크: ₩{row['RiskAmount']:,} | 예상 수수료: ₩{int(fee):,}")
-                    
-                    if not curr_price:
-                        st.caption("⚠️ 현재가를 불러올 수 없습니다.")
+
+                # Progress Bar
+                progress_val = min(max((r_multiple + 1.0) / 4.0, 0.0), 1.0)
+                st.progress(progress_val)
+                
+                st.caption(f"진입: {entry_price:,.0f} | 손절: {sl:,.0f} | 리스크: ₩{row['RiskAmount']:,} | 예상 수수료: ₩{int(fee):,}")
+                
+                if not data['HasQuote']:
+                    st.caption("⚠️ 현재가를 불러올 수 없습니다.")
+
+
+# === TAB 2: ACTIVE TRADES ===
+with tab2, PROFILER.span("render.active"):
+    col_header, col_live, col_btn = st.columns([3, 1, 1])
+    col_header.subheader("보유 중인 포지션")
+    live = col_live.toggle("실시간", key="live_mode", help="보유 포지션만 주기적으로 다시 계산합니다 (캐시된 시세 사용)")
+    live_interval = None
+    if live:
+        live_interval = col_live.selectbox("갱신 주기", LIVE_REFRESH_INTERVALS, index=1, key="live_interval",
+                                           format_func=lambda s: f"{s}초", label_visibility="collapsed")
+    if col_btn.button("🔄 시세 갱신"):
+        st.cache_data.clear()
+        tm.refresh_quotes()
+        st.rerun()
+
+    if selected_account:
+        open_trades = tm.get_trades(selected_account, "Open")
+        
+        if not open_trades.empty:
+            # Only this fragment reruns on the live timer; actions that write still rerun the app
+            st.fragment(render_positions, run_every=live_interval)(open_trades, live_interval)
 
         else:
             st.info("현재 보유 중인 주식이 없습니다.")
@@ -376,7 +492,7 @@ with tab2:
         st.warning("계좌를 먼저 선택해주세요.")
 
 # === TAB 3: STATS ===
-with tab3:
+with tab3, PROFILER.span("render.stats"):
     st.subheader("매매 성과 분석")
     
     # Sub-tabs for Stats
@@ -384,11 +500,9 @@ with tab3:
     
     if stat_type == "📊 진행 중 (Active)":
         # Filter Logic: All Accounts or Specific
-        filter_opts = ["전체 (All Accounts)"] + account_names
-        target_account_filter = st.selectbox("계좌 필터", filter_opts, index=0)
-        
-        # Determine query param
-        q_acc = None if target_account_filter == "전체 (All Accounts)" else target_account_filter
+        # None = all accounts
+        q_acc = st.selectbox("계좌 필터", [None] + account_ids, index=0,
+                             format_func=lambda a: "전체 (All Accounts)" if a is None else account_names[a])
         
         active_df = tm.get_trades(q_acc, "Open")
         
@@ -396,44 +510,22 @@ with tab3:
             # Calculate summary
             st.caption("현재 보유 중인 종목들의 현황입니다.")
             
-            summary_list = []
-            total_buy_amt = 0.0
-            total_net_pnl = 0.0
+            # Vectorized valuation (prefetched quote snapshot + Kiwoom fee model)
+            prices, _ = tm.get_quote_snapshot(active_df['Symbol'])
+            valuation = tm.value_positions(active_df, prices)
+            total_buy_amt = valuation['EntryAmount'].sum()
+            total_net_pnl = valuation['NetPnL'].sum()
             
-            for idx, row in active_df.iterrows():
-                curr = tm.fetch_current_price(row['Symbol'])
-                curr = float(curr) if curr else float(row['EntryPrice'])
-                entry = float(row['EntryPrice'])
-                qty = int(row['Quantity'])
-                
-                entry_amt = entry * qty
-                curr_amt = curr * qty
-                
-                # Fee logic: Tax 0.2% + Fee 0.015% (Kiwoom Floor Logic)
-                buy_fee = math.floor((entry_amt * 0.00015) / 10) * 10
-                sell_fee = math.floor((curr_amt * 0.00015) / 10) * 10
-                tax = math.floor(curr_amt * 0.002)
-                
-                fee = buy_fee + sell_fee + tax
-                
-                net_pnl = (curr_amt - entry_amt) - fee
-                
-                # Accumulate Totals
-                total_buy_amt += entry_amt
-                total_net_pnl += net_pnl
-                
-                stock_name = tm.get_stock_name(row['Symbol'])
-                
-                summary_list.append({
-                    "Account": row['AccountID'],
-                    "종목명": stock_name,
-                    "Symbol": row['Symbol'],
-                    "매수가": f"{entry:,.0f}",
-                    "현재가": f"{curr:,.0f}",
-                    "수량": qty,
-                    "평가손익(Net)": int(net_pnl),
-                    "수익률": f"{(net_pnl/(entry*qty)*100):.2f}%"
-                })
+            summary_df = pd.DataFrame({
+                "Account": active_df['AccountID'].map(account_names),
+                "종목명": active_df['Symbol'].map(tm.get_stock_name),
+                "Symbol": active_df['Symbol'],
+                "매수가": active_df['EntryPrice'].map("{:,.0f}".format),
+                "현재가": valuation['CurrentPrice'].map("{:,.0f}".format),
+                "수량": active_df['Quantity'].astype(int),
+                "평가손익(Net)": valuation['NetPnL'].astype(int),
+                "수익률": (valuation['NetPnL'] / valuation['EntryAmount'] * 100).map("{:.2f}%".format)
+            })
             
             # Display Total Metrics
             total_roi = (total_net_pnl / total_buy_amt * 100) if total_buy_amt > 0 else 0.0
@@ -445,20 +537,39 @@ with tab3:
             
             st.divider()
             
-            st.dataframe(pd.DataFrame(summary_list))
+            st.dataframe(summary_df.reset_index(drop=True))
         else:
             st.info("진행 중인 매매가 없습니다.")
+        
+        # --- EOD SNAPSHOTS (precomputed by `journal_cli.py eod-snapshot`) ---
+        nav_history = load_nav_history_cached(tuple(snapshot_dates()))
+        if not nav_history.empty:
+            st.divider()
+            if q_acc:
+                nav_history = nav_history[nav_history['AccountID'] == q_acc]
+            nav_by_date = nav_history.groupby("Date")[["NAV", "UnrealizedPnL"]].sum().reset_index()
+            if not nav_by_date.empty:
+                last = nav_by_date.iloc[-1]
+                st.caption(f"📅 마감 스냅샷 기준일: {last['Date']}")
+                n1, n2 = st.columns(2)
+                n1.metric("순자산 (NAV)", f"₩{int(last['NAV']):,}")
+                n2.metric("미실현 손익", f"₩{int(last['UnrealizedPnL']):,}")
+                if len(nav_by_date) > 1:
+                    import plotly.express as px  # deferred: heavy import
+                    fig = px.line(nav_by_date, x="Date", y="NAV", title="순자산 추이 (EOD)", markers=True)
+                    st.plotly_chart(fig, use_container_width=True)
             
     else:
         if selected_account:
-            history = tm.get_trades(selected_account, "Closed")
+            # Period filter, sort and account/status filters are evaluated by the storage backend
+            period_days = {"전체": None, "최근 30일": 30, "최근 90일": 90, "최근 1년": 365}
+            period = st.selectbox("기간", list(period_days), key="h_period")
+            period_start = None
+            if period_days[period]:
+                period_start = (datetime.now() - pd.Timedelta(days=period_days[period])).strftime("%Y-%m-%d")
+            history = tm.get_trades(selected_account, "Closed", date_from=period_start, sort="ExitDate", descending=True)
             
             if not history.empty:
-                # Sort by Exit Date (descending)
-                if 'ExitDate' in history.columns:
-                    history['ExitDate'] = pd.to_datetime(history['ExitDate'], errors='coerce')
-                    history = history.sort_values("ExitDate", ascending=False)
-                
                 # --- KPIs ---
                 total_pnl = history['PnL'].sum()
                 winning_trades = len(history[history['PnL'] > 0])
@@ -472,17 +583,57 @@ with tab3:
                 k3.metric("평균 R-배수", f"{avg_r:.2f}R")
                 
                 # --- EQUITY CURVE ---
-                history_chart = history.sort_values("ExitDate")
-                history_chart['CumulativePnL'] = history_chart['PnL'].cumsum() + float(acc_row['InitialBalance'])
+                history_chart = history.iloc[::-1].copy()
+                # Equity before the period: realized P&L of earlier exits (PnL column only)
+                start_equity = float(acc_row['InitialBalance'])
+                if period_start:
+                    before = tm.get_trades(selected_account, "Closed", date_to=(pd.Timestamp(period_start) - pd.Timedelta(days=1)).strftime("%Y-%m-%d"), columns=["PnL"])
+                    start_equity += float(before['PnL'].sum()) if not before.empty else 0.0
+                history_chart['CumulativePnL'] = history_chart['PnL'].cumsum() + start_equity
+                import plotly.express as px  # deferred: only needed once there is history to chart
                 fig = px.line(history_chart, x='ExitDate', y='CumulativePnL', title="자산 증감 (Equity Curve)", markers=True)
                 st.plotly_chart(fig, use_container_width=True)
                 
                 st.divider()
                 
                 # --- HISTORY LIST (CARD VIEW) ---
-                for idx, row in history.iterrows():
-                    stock_name = tm.get_stock_name(row['Symbol'])
-                    title_label = f"{stock_name} ({row['Symbol']})" if stock_name else row['Symbol']
+                # Filter/sort/paginate on the DataFrame; widgets only for the visible page
+                names = tm.get_stock_names(history['Symbol'].unique())
+                # Symbol is categorical: map the text, and keep unlisted symbols as None (not NaN)
+                stock_names = history['Symbol'].astype(str).map(names)
+                history['StockName'] = stock_names.astype(object).where(stock_names.notna(), None)
+                
+                f1, f2, f3, f4 = st.columns([2, 1, 1, 1])
+                h_query = f1.text_input("종목 검색 (코드/이름)", key="h_query")
+                h_result = f2.selectbox("결과", ["전체", "수익", "손실"], key="h_result")
+                h_sort = f3.selectbox("정렬", ["청산일", "손익", "R-배수"], key="h_sort")
+                h_desc = f4.selectbox("순서", ["내림차순", "오름차순"], key="h_order") == "내림차순"
+                
+                view = history
+                if h_query:
+                    q = h_query.strip().lower()
+                    view = view[view['Symbol'].astype(str).str.lower().str.contains(q, regex=False)
+                                | view['StockName'].fillna("").str.lower().str.contains(q, regex=False)]
+                if h_result == "수익":
+                    view = view[view['PnL'] > 0]
+                elif h_result == "손실":
+                    view = view[view['PnL'] < 0]
+                sort_col = {"청산일": "ExitDate", "손익": "PnL", "R-배수": "R_Multiple"}[h_sort]
+                view = view.sort_values(sort_col, ascending=not h_desc, kind="stable")
+                
+                pg1, pg2, pg3 = st.columns([1, 1, 2])
+                page_size = pg1.selectbox("페이지당", [10, 20, 50, 100], index=1, key="h_page_size")
+                page_count = max(1, -(-len(view) // page_size))
+                if st.session_state.get("h_page", 1) > page_count:
+                    st.session_state["h_page"] = 1  # filter shrank the result set
+                page = pg2.number_input("페이지", min_value=1, max_value=page_count, value=1, step=1, key="h_page")
+                pg3.caption(f"총 {len(view):,}건 / {page_count:,} 페이지")
+                
+                page_df = view.iloc[(page - 1) * page_size: page * page_size]
+                
+                for idx, row in page_df.iterrows():
+                    stock_name = row['StockName']
+                    title_label = f"{stock_name} ({row['Symbol']})" if pd.notna(stock_name) and stock_name else row['Symbol']
                     border_color = "🟢" if row['PnL'] > 0 else "🔴" if row['PnL'] < 0 else "⚪"
                     
                     with st.expander(f"{border_color} {title_label} - {row['ExitDate'].strftime('%Y-%m-%d') if pd.notnull(row['ExitDate']) else '-'} (PnL: ₩{int(row['PnL']):,})"):
@@ -521,3 +672,24 @@ with tab3:
                 st.info("아직 완료된 매매 기록이 없습니다.")
         else:
             st.warning("계좌를 먼저 선택해주세요.")
+
+# --- DEV PANEL: PROFILING ---
+if show_dev_panel:
+    with st.sidebar.expander("🛠️ 성능 계측 (Dev)"):
+        # JOURNAL_PROFILE=1 already profiles every session; the checkbox can't turn that off
+        profile_on = st.checkbox("계측 활성화", value=PROFILER.enabled, key="dev_profile", disabled=PROFILER.enabled)
+        if profile_on or PROFILER.enabled:
+            session_id = st.session_state.dev_session
+            st.caption(f"이번 실행 ({rerun_started.strftime('%H:%M:%S')}) 기준 집계")
+            st.dataframe(PROFILER.summary(session=session_id, rerun=st.session_state.dev_rerun),
+                         use_container_width=True)
+            st.caption("백그라운드 시세 갱신 (지난 실행 이후, 모든 세션 공용)")
+            st.dataframe(PROFILER.summary(since=background_since, session=PROFILE_BACKGROUND_TAG),
+                         use_container_width=True)
+            st.download_button("📤 로그 내보내기 (JSONL)", PROFILER.to_jsonl(session=session_id),
+                               file_name=f"journal_profile_{rerun_started.strftime('%Y%m%d_%H%M%S')}.jsonl",
+                               mime="application/x-ndjson")
+            if st.button("🧹 로그 비우기", key="dev_profile_clear"):
+                PROFILER.clear(session=session_id)
+        else:
+            st.caption("체크하면 다음 실행부터 계측합니다.")
@@ -0,0 +1,164 @@
+"""
+Command-line maintenance tasks for the trading journal.
+
+    python journal_cli.py migrate-sqlite [--db journal.db] [--trades trades.csv] [--accounts accounts.csv] [--meta journal_meta.json]
+    python journal_cli.py import-fills ACCOUNT FILE.csv [--dry-run]
+    python journal_cli.py eod-snapshot [--date YYYY-MM-DD] [--dir snapshots]
+    python journal_cli.py profile-startup [--json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from storage import ACCOUNTS_FILE, TRADES_FILE, SQLITE_FILE, META_FILE, migrate_csv_to_sqlite
+
+
+def cmd_migrate_sqlite(args):
+    counts = migrate_csv_to_sqlite(args.db, args.trades, args.accounts, args.meta)
+    print(f"Imported {counts[ACCOUNTS_FILE]} accounts and {counts[TRADES_FILE]} trades into {args.db}")
+    print(f"Set JOURNAL_BACKEND=sqlite (and JOURNAL_DB={args.db}) to use it.")
+    return 0
+
+
+def cmd_import_fills(args):
+    from broker_import import import_fills
+    from trade_logic import TradeManager
+
+    tm = TradeManager()
+    account_id = tm.resolve_account(args.account)
+    if account_id is None:
+        print(f"Unknown account: {args.account}", file=sys.stderr)
+        return 1
+    result = import_fills(tm, account_id, args.file, dry_run=args.dry_run, encoding=args.encoding)
+    print(f"Fills read: {result.fills} (duplicates skipped: {result.duplicates}, unmatched sell shares: {int(result.unmatched)})")
+    print(f"Trades: {result.closed_count} closed, {result.open_count} open")
+    if result.updates:
+        print(f"Earlier imported positions closed or resized: {len(result.updates)}")
+    if args.dry_run:
+        print(result.trades.head(20).to_string())
+        print("Dry run: nothing written.")
+    elif result.committed:
+        print(f"Imported into account {args.account}.")
+    return 0
+
+
+def cmd_eod_snapshot(args):
+    from datetime import datetime
+
+    from eod_snapshot import run_eod
+    from trade_logic import TradeManager
+
+    as_of = datetime.strptime(args.date, "%Y-%m-%d").date() if args.date else None
+    positions, accounts, paths = run_eod(TradeManager(), as_of=as_of, root=args.dir)
+    for r in accounts.itertuples(index=False):
+        print(f"{r.Date} {r.Name}: NAV {r.NAV:,.0f} (unrealized {r.UnrealizedPnL:,.0f}, {r.Positions} positions)")
+    print(f"Wrote {paths[0]} and {paths[1]}")
+    unquoted = int(accounts['Unquoted'].sum()) if not accounts.empty else 0
+    if unquoted:
+        # Non-zero exit so cron surfaces it; the snapshot is still written (valued at entry)
+        print(f"Warning: {unquoted} positions had no quote and were valued at their entry price", file=sys.stderr)
+        return 1
+    return 0
+
+
+# Imported in this order by the app on a cold start; the rest load on first use
+STARTUP_IMPORTS = ["streamlit", "pandas", "storage", "trade_logic", "broker_import"]
+DEFERRED_IMPORTS = ["plotly.express", "FinanceDataReader", "gspread", "oauth2client.service_account"]
+
+_IMPORT_PROBE = """
+import json, sys, time
+timings = []
+for name in sys.argv[1:]:
+    start = time.perf_counter()
+    try:
+        __import__(name)
+        timings.append([name, time.perf_counter() - start, None])
+    except Exception as e:
+        timings.append([name, time.perf_counter() - start, str(e)])
+print(json.dumps(timings))
+"""
+
+
+def _time_imports(names):
+    # Fresh interpreter so nothing is already cached in sys.modules
+    out = subprocess.run([sys.executable, "-c", _IMPORT_PROBE, *names], capture_output=True, text=True, check=True,
+                         cwd=os.path.dirname(os.path.abspath(__file__)))
+    return [{"component": n, "seconds": round(t, 4), "error": err} for n, t, err in json.loads(out.stdout)]
+
+
+def _time_init():
+    from trade_logic import TradeManager
+
+    steps = []
+    def step(name, fn):
+        start = time.perf_counter()
+        result = fn()
+        steps.append({"component": name, "seconds": round(time.perf_counter() - start, 4), "error": None})
+        return result
+
+    tm = step("TradeManager()", TradeManager)
+    step("backend connect + init_files", lambda: tm.backend)
+    step("first get_accounts", tm.get_accounts)
+    step("first get_trades", tm.get_trades)
+    return steps
+
+
+def cmd_profile_startup(args):
+    report = {
+        "imports": _time_imports(STARTUP_IMPORTS),
+        "deferred_imports": _time_imports(DEFERRED_IMPORTS),
+        "init": _time_init(),
+    }
+    report["cold_start_seconds"] = round(sum(r["seconds"] for r in report["imports"] + report["init"]), 4)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0
+    for section in ("imports", "init", "deferred_imports"):
+        print(f"[{section}]")
+        for r in report[section]:
+            note = f"  ({r['error']})" if r["error"] else ""
+            print(f"  {r['component']:<32} {r['seconds'] * 1000:8.1f} ms{note}")
+    print(f"Cold start (imports + init): {report['cold_start_seconds'] * 1000:.0f} ms")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Trading journal maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("migrate-sqlite", help="Import trades.csv/accounts.csv into a SQLite journal")
+    p.add_argument("--db", default=SQLITE_FILE)
+    p.add_argument("--trades", default=TRADES_FILE)
+    p.add_argument("--accounts", default=ACCOUNTS_FILE)
+    p.add_argument("--meta", default=META_FILE)
+    p.set_defaults(func=cmd_migrate_sqlite)
+
+    p = sub.add_parser("import-fills", help="Import a broker fill export (Kiwoom-style CSV)")
+    p.add_argument("account", help="Account name or AccountID")
+    p.add_argument("file")
+    p.add_argument("--dry-run", action="store_true", help="Preview without writing")
+    p.add_argument("--encoding", default=None, help="Defaults to UTF-8, falling back to CP949")
+    p.set_defaults(func=cmd_import_fills)
+
+    p = sub.add_parser("eod-snapshot", help="Mark all open positions to market and write a dated snapshot")
+    p.add_argument("--date", default=None, help="Snapshot date (default: last trading day)")
+    p.add_argument("--dir", default="snapshots", help="Snapshot directory")
+    p.set_defaults(func=cmd_eod_snapshot)
+
+    p = sub.add_parser("profile-startup", help="Measure import and initialization cost per component")
+    p.add_argument("--json", action="store_true", help="Machine-readable output")
+    p.set_defaults(func=cmd_profile_startup)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+"""
+Lightweight hot-path instrumentation.
+
+    with PROFILER.span("load_df", table="trades.csv") as ev:
+        ...
+        ev["hit"] = True
+
+Spans record duration plus any fields set on them (hit, bytes_read, ...)
+into a bounded in-memory event log. While disabled, span() returns a shared
+no-op object, so instrumented code pays one attribute check.
+
+Besides the process-wide switch, activate() turns profiling on for the
+calling thread only and stamps tags (e.g. session/rerun ids) on its events,
+so one app session can profile itself without affecting the others. bind()
+carries that activation into pool threads; process-wide workers use
+activate_background() and record under their own tag.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from itertools import count
+
+import pandas as pd
+
+PROFILE_ENV = "JOURNAL_PROFILE"
+PROFILE_MAX_EVENTS = 20000
+# Session tag of process-wide worker threads (quote prefetcher)
+PROFILE_BACKGROUND_TAG = "background"
+# Background workers record while some session activated profiling within this many seconds
+PROFILE_SESSION_WINDOW = 120
+
+
+class _NullSpan:
+    # Shared no-op span used while profiling is off
+    def __enter__(self):
+        return {}
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, profiler, name, fields):
+        self.profiler = profiler
+        self.fields = fields
+        self.fields["name"] = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self.fields
+
+    def __exit__(self, exc_type, exc, tb):
+        self.fields["ms"] = (time.perf_counter() - self.start) * 1000
+        if exc_type is not None:
+            self.fields["error"] = exc_type.__name__
+        self.profiler.record(self.fields)
+        return False
+
+
+class Profiler:
+    def __init__(self, enabled=None, max_events=PROFILE_MAX_EVENTS):
+        self.enabled = os.environ.get(PROFILE_ENV, "") not in ("", "0") if enabled is None else enabled
+        self._events = deque(maxlen=max_events)
+        self._seq = count(1)
+        self._last_seq = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._session_active_at = 0.0
+
+    def activate(self, enabled=False, **tags):
+        """Per-thread switch; `tags` are added to every event recorded on this thread."""
+        self._local.enabled = enabled
+        self._local.tags = tags
+        if enabled:
+            self._session_active_at = time.time()
+
+    def activate_background(self, **tags):
+        """
+        Switch for a process-wide worker thread: on while any session has
+        profiling activated recently; its events are tagged session=PROFILE_BACKGROUND_TAG.
+        """
+        self._local.enabled = time.time() - self._session_active_at < PROFILE_SESSION_WINDOW
+        self._local.tags = dict(tags, session=PROFILE_BACKGROUND_TAG)
+
+    def bind(self, fn):
+        """Wraps `fn` to run with the calling thread's activation and tags (for pool threads)."""
+        enabled = getattr(self._local, "enabled", False)
+        tags = getattr(self._local, "tags", {})
+        if not enabled:
+            return fn
+
+        def bound(*args, **kwargs):
+            saved = (getattr(self._local, "enabled", False), getattr(self._local, "tags", {}))
+            self._local.enabled, self._local.tags = enabled, tags
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._local.enabled, self._local.tags = saved
+        return bound
+
+    @property
+    def active(self):
+        # Whether spans on the calling thread record (process-wide or activated here)
+        return self.enabled or getattr(self._local, "enabled", False)
+
+    def span(self, name, **fields):
+        if not self.enabled and not getattr(self._local, "enabled", False):
+            return _NULL_SPAN
+        return _Span(self, name, fields)
+
+    def record(self, fields):
+        for key, value in getattr(self._local, "tags", {}).items():
+            fields.setdefault(key, value)
+        with self._lock:
+            self._last_seq = next(self._seq)
+            fields["seq"] = self._last_seq
+            fields["ts"] = time.time()
+            fields["thread"] = threading.current_thread().name
+            self._events.append(fields)
+
+    def mark(self):
+        """Sequence number of the latest event; pass to events()/summary() as `since`."""
+        return self._last_seq
+
+    def events(self, since=0, **tags):
+        """Events after `since` whose fields match all `tags`."""
+        with self._lock:
+            return [e for e in self._events
+                    if e["seq"] > since and all(e.get(k) == v for k, v in tags.items())]
+
+    def clear(self, **tags):
+        # Drops the events matching `tags` (all of them without tags)
+        with self._lock:
+            kept = [e for e in self._events if tags and not all(e.get(k) == v for k, v in tags.items())]
+            self._events.clear()
+            self._events.extend(kept)
+
+    def summary(self, since=0, **tags):
+        """Per-span totals: calls, time, cache hits/misses and bytes moved."""
+        events = self.events(since, **tags)
+        if not events:
+            return pd.DataFrame(columns=["calls", "total_ms", "mean_ms", "max_ms", "hits", "misses", "bytes_read", "bytes_written"])
+        df = pd.DataFrame(events)
+        for col in ("hit", "bytes_read", "bytes_written"):
+            if col not in df:
+                df[col] = None
+        hit = df["hit"]
+        df["hits"] = (hit == True).astype(int)
+        df["misses"] = (hit == False).astype(int)
+        summary = df.groupby("name").agg(
+            calls=("ms", "size"),
+            total_ms=("ms", "sum"),
+            mean_ms=("ms", "mean"),
+            max_ms=("ms", "max"),
+            hits=("hits", "sum"),
+            misses=("misses", "sum"),
+            bytes_read=("bytes_read", lambda s: pd.to_numeric(s, errors="coerce").sum()),
+            bytes_written=("bytes_written", lambda s: pd.to_numeric(s, errors="coerce").sum()),
+        )
+        return summary.sort_values("total_ms", ascending=False).round(2)
+
+    def to_jsonl(self, since=0, **tags):
+        # One JSON object per event (structured log export)
+        return "".join(json.dumps(e, ensure_ascii=False, default=str) + "\n" for e in self.events(since, **tags))
+
+    def export(self, path, since=0):
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(self.to_jsonl(since))
+
+
+def frame_bytes(df):
+    # In-memory size of a DataFrame, used as the byte count for reads/writes
+    return int(df.memory_usage(index=False, deep=False).sum()) if df is not None else 0
+
+
+PROFILER = Profiler()
@@ -0,0 +1,345 @@
+"""
+Offline-first journal: a local SQLite store is the primary copy and the
+Google Sheet is a replica kept in sync in the background.
+
+- Every local write also records the changed row keys in a durable outbox
+  (same SQLite transaction), so pending changes survive restarts.
+- A syncer thread reconciles each table three-way per row key (TradeID /
+  AccountID) against the hash last seen on both sides (the sync base):
+  local-only changes are pushed as one batched Sheets update, remote-only
+  changes are pulled, and rows changed on both sides are recorded as
+  conflicts and left alone until resolved.
+- A fresh local store is filled by a blocking first pull, and the ID
+  counters (meta last_trade_id / last_account_id) are raised on both sides
+  to the highest ID either side has seen, so new rows don't reuse remote keys.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+from storage import (
+    ACCOUNTS_FILE, TRADES_FILE, ACCOUNT_COLUMNS, TRADE_COLUMNS, ACCOUNT_KEY_PREFIX,
+    StorageBackend, SQLiteBackend, _to_cell,
+)
+
+# Seconds between sync cycles (env override); local writes wake the syncer after the debounce
+SYNC_INTERVAL_ENV = "JOURNAL_SYNC_INTERVAL"
+SYNC_INTERVAL = 30
+SYNC_DEBOUNCE = 2
+
+SYNC_TABLES = {ACCOUNTS_FILE: ACCOUNT_COLUMNS, TRADES_FILE: TRADE_COLUMNS}
+# Meta ID counters kept in step with the sheet: meta key -> table whose keys they number
+SYNC_COUNTERS = {"last_trade_id": TRADES_FILE, "last_account_id": ACCOUNTS_FILE}
+
+
+def _canonical(value):
+    # Sheets hands back numbers for numeric-looking text; compare both sides as normalized strings
+    value = _to_cell(value)
+    if value is None or value == "":
+        return ""
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            return value
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, (int, float)):
+        return str(int(value)) if float(value).is_integer() else repr(round(float(value), 6))
+    return str(value)
+
+
+def _row_hashes(df, key, columns):
+    """{key: hash of the row's canonical values} (columns missing from df count as blank)."""
+    if df.empty or key not in df.columns:
+        return {}
+    hashes = {}
+    present = [c for c in columns if c in df.columns]
+    for row in df[present].itertuples(index=False, name=None):
+        values = dict(zip(present, row))
+        text = "\x1f".join(_canonical(values.get(c)) for c in columns)
+        hashes[_canonical(values[key])] = hashlib.sha1(text.encode("utf-8")).hexdigest()
+    return hashes
+
+
+def _counter_value(value):
+    # Number behind a TradeID / surrogate account key ("acct-7" -> 7); None for legacy name keys
+    text = _canonical(value)
+    if isinstance(text, str) and text.startswith(ACCOUNT_KEY_PREFIX):
+        text = text[len(ACCOUNT_KEY_PREFIX):]
+    try:
+        return int(text)
+    except (TypeError, ValueError):
+        return None
+
+
+def _max_counter(df, key):
+    if df.empty or key not in df.columns:
+        return 0
+    return max((n for n in map(_counter_value, df[key]) if n is not None), default=0)
+
+
+def _blank_missing(df):
+    # Full-sheet writes need JSON-safe cells: NaN -> ""
+    return df.astype(object).where(df.notna(), "")
+
+
+class SyncedBackend(StorageBackend):
+    """
+    StorageBackend whose reads and writes hit only the local SQLite store;
+    a background syncer replicates to/from `remote` (a SheetsBackend).
+    """
+    supports_queries = True
+
+    def __init__(self, local_path, remote, interval=None):
+        self.local = SQLiteBackend(local_path)
+        self.local.write_hooks.append(self._enqueue)
+        self.remote = remote
+        self.interval = interval or float(os.environ.get(SYNC_INTERVAL_ENV, SYNC_INTERVAL))
+        self._sync_db = None  # syncer's own connection (see _syncer_store)
+        self._wake = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._peaks = {}  # table -> highest numbered key seen on either side (last cycle)
+        self.last_sync = None
+        self.last_error = None
+
+    # --- StorageBackend (local) ---
+    def init_tables(self):
+        self.local.init_tables()
+        with self.local.transaction() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS sync_outbox (seq INTEGER PRIMARY KEY AUTOINCREMENT, tbl TEXT, key TEXT, queued_at REAL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS sync_base (tbl TEXT, key TEXT, hash TEXT, PRIMARY KEY (tbl, key))")
+            conn.execute("CREATE TABLE IF NOT EXISTS sync_conflicts (tbl TEXT, key TEXT, local TEXT, remote TEXT, detected_at REAL, PRIMARY KEY (tbl, key))")
+            fresh = not any(conn.execute(f"SELECT 1 FROM {name} LIMIT 1").fetchone()
+                            for name in ("accounts", "trades", "sync_base"))
+        if fresh:
+            # Pull the sheet before any local write can allocate keys it already uses
+            self.sync_once()
+        self.start()
+
+    def read_table(self, table):
+        return self.local.read_table(table)
+
+    def query_trades(self, query):
+        return self.local.query_trades(query)
+
+    def delete_account_trades(self, account_id):
+        count = self.local.delete_account_trades(account_id)
+        if count:
+            self._schedule()
+        return count
+
+    def write_table(self, table, df):
+        self.local.write_table(table, df)
+        self._schedule()
+
+    def write_changes(self, table, df, base_rows, updated, rewrite):
+        self.local.write_changes(table, df, base_rows, updated, rewrite)
+        self._schedule()
+
+    def signature(self, table, force=False):
+        return self.local.signature(table, force)
+
+    def read_meta(self, key, default=None):
+        return self.local.read_meta(key, default)
+
+    def write_meta(self, key, value):
+        self.local.write_meta(key, value)
+
+    def _enqueue(self, conn, table, keys):
+        # Runs inside the local write transaction: the change and its outbox entry commit together
+        now = time.time()
+        if keys is None:
+            conn.execute("INSERT INTO sync_outbox (tbl, key, queued_at) VALUES (?, NULL, ?)", (table, now))
+        else:
+            conn.executemany("INSERT INTO sync_outbox (tbl, key, queued_at) VALUES (?, ?, ?)",
+                             [(table, _canonical(k), now) for k in keys])
+
+    def _schedule(self):
+        self._wake.set()
+
+    # --- Syncer ---
+    def start(self):
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True, name="sheets-sync")
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            woke = self._wake.wait(self.interval)
+            if woke:
+                # Let a burst of writes land so they go out as one update
+                time.sleep(SYNC_DEBOUNCE)
+                self._wake.clear()
+            self.sync_once()
+
+    def _syncer_store(self):
+        # A second connection: its commits bump PRAGMA data_version for the app's connection,
+        # so TradeManager's table cache notices pulled rows
+        if self._sync_db is None:
+            self._sync_db = SQLiteBackend(self.local.path)
+        return self._sync_db
+
+    def sync_once(self):
+        """One reconcile pass over both tables. Returns {table: (pushed, pulled, conflicts)}."""
+        with self._sync_lock:
+            try:
+                result = {table: self._sync_table(table) for table in SYNC_TABLES}
+                self._sync_counters()
+                self.last_sync = time.time()
+                self.last_error = None
+                return result
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Sheets sync failed (will retry): {e}")
+                return None
+
+    def _sync_table(self, table):
+        store = self._syncer_store()
+        key = SQLiteBackend.KEYS[table]
+        conn = store.conn
+
+        with store.transaction():
+            max_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM sync_outbox WHERE tbl = ?", (table,)).fetchone()[0]
+            local = store.read_table(table)
+            base = dict(conn.execute("SELECT key, hash FROM sync_base WHERE tbl = ?", (table,)).fetchall())
+            conflicted = {r[0] for r in conn.execute("SELECT key FROM sync_conflicts WHERE tbl = ?", (table,))}
+        remote = self.remote.read_table(table)
+        self._peaks[table] = max(_max_counter(local, key), _max_counter(remote, key))
+
+        columns = list(SYNC_TABLES[table]) + [c for c in local.columns if c not in SYNC_TABLES[table]]
+        local_hashes = _row_hashes(local, key, columns)
+        remote_hashes = _row_hashes(remote, key, columns)
+
+        push, pull, conflicts, settled = [], [], [], {}
+        for k in set(local_hashes) | set(remote_hashes) | set(base):
+            if k in conflicted:
+                continue
+            l, r, b = local_hashes.get(k), remote_hashes.get(k), base.get(k)
+            if l == r:
+                settled[k] = l
+            elif l == b:
+                pull.append(k)
+                settled[k] = r
+            elif r == b:
+                push.append(k)
+                settled[k] = l
+            else:
+                conflicts.append(k)
+
+        local_keys = local[key].map(_canonical) if not local.empty else pd.Series(dtype=str)
+        remote_keys = remote[key].map(_canonical) if not remote.empty else pd.Series(dtype=str)
+
+        if push:
+            self._push(table, key, columns, local, local_keys, remote, remote_keys, set(push))
+
+        with store.transaction():
+            newer = conn.execute("SELECT COUNT(*) FROM sync_outbox WHERE tbl = ? AND seq > ?", (table, max_seq)).fetchone()[0]
+            if pull and not newer:
+                rows = remote[remote_keys.isin(pull)] if not remote.empty else remote
+                store.upsert_rows(table, rows[[c for c in columns if c in rows.columns]])
+                gone = [k for k in pull if k not in remote_hashes]
+                if gone:
+                    store.delete_rows(table, gone)
+            elif pull:
+                # Local writes landed meanwhile; pull next cycle against the new local state
+                settled = {k: h for k, h in settled.items() if k not in pull}
+                pull = []
+            for k in conflicts:
+                local_row = local[local_keys == k].to_dict("records")
+                remote_row = remote[remote_keys == k].to_dict("records")
+                conn.execute("INSERT OR REPLACE INTO sync_conflicts (tbl, key, local, remote, detected_at) VALUES (?, ?, ?, ?, ?)",
+                             (table, k, json.dumps(local_row[0] if local_row else None, default=str, ensure_ascii=False),
+                              json.dumps(remote_row[0] if remote_row else None, default=str, ensure_ascii=False), time.time()))
+            conn.executemany("INSERT OR REPLACE INTO sync_base (tbl, key, hash) VALUES (?, ?, ?)",
+                             [(table, k, h) for k, h in settled.items() if h is not None])
+            conn.executemany("DELETE FROM sync_base WHERE tbl = ? AND key = ?",
+                             [(table, k) for k, h in settled.items() if h is None])
+            conn.execute("DELETE FROM sync_outbox WHERE tbl = ? AND seq <= ?", (table, max_seq))
+        return len(push), len(pull), len(conflicts)
+
+    def _sync_counters(self):
+        """Raises each ID counter, locally and on the sheet, to the highest value either side has seen."""
+        conn = self._syncer_store().conn
+        for meta_key, table in SYNC_COUNTERS.items():
+            remote_value = _counter_value(self.remote.read_meta(meta_key)) or 0
+            target = max(remote_value, self._peaks.get(table, 0))
+            with self._syncer_store().transaction():
+                # Only ever raised, so a concurrent local allocation is never rolled back
+                conn.execute("INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE "
+                             "SET value = excluded.value WHERE CAST(value AS INTEGER) < CAST(excluded.value AS INTEGER)",
+                             (meta_key, str(target)))
+                local_value = int(conn.execute("SELECT value FROM meta WHERE key = ?", (meta_key,)).fetchone()[0])
+            if local_value > remote_value:
+                self.remote.write_meta(meta_key, local_value)
+
+    def _push(self, table, key, columns, local, local_keys, remote, remote_keys, keys):
+        """Applies local rows for `keys` to the remote table in one write_changes call."""
+        local_rows = local[local_keys.isin(keys)].set_index(local_keys[local_keys.isin(keys)])
+        if remote.empty or list(remote.columns) != columns:
+            # New sheet or a different header: rebuild the replica from the merged table
+            parts = [df.reindex(columns=columns) for df in (remote[~remote_keys.isin(keys)], local_rows) if not df.empty]
+            merged = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=columns)
+            self.remote.write_table(table, _blank_missing(merged))
+            return
+
+        new_remote = remote.copy()
+        deleted = remote_keys.isin(keys) & ~remote_keys.isin(local_rows.index)
+        updated = {}
+        for idx in remote.index[remote_keys.isin(local_rows.index)]:
+            row = local_rows.loc[remote_keys[idx]]
+            changed = [c for c in columns if _canonical(row.get(c)) != _canonical(remote.at[idx, c])]
+            for c in changed:
+                new_remote.at[idx, c] = _to_cell(row.get(c))
+            if changed:
+                updated[idx] = set(changed)
+        appended = local_rows[~local_rows.index.isin(remote_keys)].reindex(columns=columns)
+        if not appended.empty:
+            new_remote = pd.concat([new_remote, appended], ignore_index=True)
+
+        if deleted.any():
+            new_remote = new_remote.drop(index=remote.index[deleted]).reset_index(drop=True)
+            self.remote.write_changes(table, _blank_missing(new_remote), len(remote), {}, True)
+        else:
+            self.remote.write_changes(table, new_remote, len(remote), updated, False)
+
+    # --- Status / conflicts ---
+    def status(self):
+        with self.local.transaction() as conn:
+            pending = conn.execute("SELECT COUNT(*) FROM sync_outbox").fetchone()[0]
+            conflicts = pd.read_sql_query("SELECT tbl, key, local, remote, detected_at FROM sync_conflicts ORDER BY detected_at", conn)
+        return {"pending": pending, "conflicts": conflicts, "last_sync": self.last_sync, "last_error": self.last_error}
+
+    def resolve_conflict(self, table, key, keep):
+        """keep="local" pushes the local row on the next cycle; keep="remote" pulls the sheet's row."""
+        key = _canonical(key)
+        with self.local.transaction() as conn:
+            row = conn.execute("SELECT local, remote FROM sync_conflicts WHERE tbl = ? AND key = ?", (table, key)).fetchone()
+            if row is None:
+                return
+            local_row, remote_row = (json.loads(v) if v else None for v in row)
+            columns = list(SYNC_TABLES[table]) + [c for c in (local_row or {}) if c not in SYNC_TABLES[table]]
+            if keep == "local":
+                # Base := remote, so the local row reads as the only change
+                remote_hash = _row_hashes(pd.DataFrame([remote_row]), SQLiteBackend.KEYS[table], columns).get(key) if remote_row else None
+                conn.execute("DELETE FROM sync_base WHERE tbl = ? AND key = ?", (table, key))
+                if remote_hash:
+                    conn.execute("INSERT INTO sync_base (tbl, key, hash) VALUES (?, ?, ?)", (table, key, remote_hash))
+                self._enqueue(conn, table, [key])
+            elif keep == "remote":
+                # Base := local, so the sheet's row reads as the only change
+                local_hash = _row_hashes(pd.DataFrame([local_row]), SQLiteBackend.KEYS[table], columns).get(key) if local_row else None
+                conn.execute("DELETE FROM sync_base WHERE tbl = ? AND key = ?", (table, key))
+                if local_hash:
+                    conn.execute("INSERT INTO sync_base (tbl, key, hash) VALUES (?, ?, ?)", (table, key, local_hash))
+            else:
+                raise ValueError("keep must be 'local' or 'remote'")
+            conn.execute("DELETE FROM sync_conflicts WHERE tbl = ? AND key = ?", (table, key))
+        self._schedule()
@@ -0,0 +1,798 @@
+import glob
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+TRADES_FILE = "trades.csv"
+ACCOUNTS_FILE = "accounts.csv"
+SQLITE_FILE = "journal.db"
+META_FILE = "journal_meta.json"
+# Counters kept in the meta store (the last TradeID / surrogate account key handed out)
+META_KEYS = ["last_trade_id", "last_account_id"]
+
+# AccountID is the account's stable key (what trades reference); Name is the editable display name
+ACCOUNT_COLUMNS = ["AccountID", "Name", "Broker", "Currency", "InitialBalance", "CurrentBalance"]
+# New accounts get opaque, never-reused keys: ACCOUNT_KEY_PREFIX + counter
+ACCOUNT_KEY_PREFIX = "acct-"
+TRADE_COLUMNS = ["TradeID", "AccountID", "Symbol", "EntryDate", "Strategy", "TrendScore",
+                 "EntryPrice", "StopLoss", "Quantity", "UnitQuantity", "RiskAmount",
+                 "Status", "ExitDate", "ExitPrice", "PnL", "R_Multiple"]
+
+# In-memory dtypes of the trades table, applied once when it is loaded (apply_trade_schema).
+# Open trades hold NaT/NaN in ExitDate/ExitPrice; storage writes them as blank cells.
+TRADE_SCHEMA = {
+    "TradeID": "int32", "AccountID": "category", "Symbol": "category", "EntryDate": "datetime64[ns]",
+    "Strategy": "object", "TrendScore": "int8", "EntryPrice": "float64", "StopLoss": "float64",
+    "Quantity": "int32", "UnitQuantity": "int32", "RiskAmount": "int64", "Status": "category",
+    "ExitDate": "datetime64[ns]", "ExitPrice": "float64", "PnL": "float64", "R_Multiple": "float64",
+}
+# Text columns read as text (keeps KRX codes like 005930 and numeric-looking keys intact)
+TRADE_TEXT_COLUMNS = {c: str for c, t in TRADE_SCHEMA.items() if t in ("category", "object")}
+ACCOUNT_TEXT_COLUMNS = {"AccountID": str, "Name": str, "Broker": str, "Currency": str}
+
+# Minimum seconds between Sheets revision checks (each check is one Drive API call)
+SHEETS_REVISION_CHECK_INTERVAL = 5
+
+
+def _to_cell(value):
+    # numpy scalars -> plain Python, NaN/NaT -> blank cell, dates -> "YYYY-MM-DD"
+    # (Sheets API needs JSON-safe values)
+    if value is pd.NaT or value is pd.NA:
+        return ""
+    if isinstance(value, pd.Timestamp):
+        return value.strftime("%Y-%m-%d")
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return ""
+    return value
+
+
+def apply_trade_schema(df):
+    """
+    Casts a trades frame as read from any backend to TRADE_SCHEMA (returns a new frame).
+    Columns that already have their dtype are left alone, so re-applying is cheap.
+    """
+    if df.columns.empty:
+        return df
+    df = df.copy(deep=False)
+    for col, dtype in TRADE_SCHEMA.items():
+        if col not in df.columns:
+            continue
+        values = df[col]
+        if dtype == "object":
+            # Free text: blanks as "", everything else as str
+            if values.dtype != object or values.hasnans:
+                df[col] = values.fillna("").astype(str)
+            continue
+        if col == "ExitPrice":
+            # Checked whatever the incoming dtype: older journals (and float
+            # frames built in memory) store 0.0 as the exit price of open trades
+            if values.dtype != dtype:
+                values = pd.to_numeric(values, errors="coerce").astype(dtype)
+            if "Status" in df.columns:
+                values = values.mask((df["Status"] == "Open") & (values == 0))
+            df[col] = values
+            continue
+        if values.dtype == dtype:
+            continue
+        if dtype == "category":
+            df[col] = values.fillna("").astype(str).astype("category")
+        elif dtype.startswith("datetime"):
+            df[col] = pd.to_datetime(values, errors="coerce", format="ISO8601")
+        else:
+            df[col] = pd.to_numeric(values, errors="coerce").fillna(0).astype(dtype)
+    return df
+
+
+def concat_trades(df, rows):
+    """Appends typed `rows` to a typed trades frame without falling back to object columns."""
+    df, rows = df.copy(deep=False), rows.copy(deep=False)
+    for col in df.columns.intersection(rows.columns):
+        if isinstance(df[col].dtype, pd.CategoricalDtype) and isinstance(rows[col].dtype, pd.CategoricalDtype):
+            categories = df[col].cat.categories.union(rows[col].cat.categories)
+            df[col] = df[col].cat.set_categories(categories)
+            rows[col] = rows[col].cat.set_categories(categories)
+    return pd.concat([df, rows], ignore_index=True)
+
+
+def set_trade_cells(df, rows, values):
+    """
+    df.loc[rows, column] = value for each {column: value}, in the column's dtype:
+    new categories are registered first, dates are parsed, blanks become NaT/NaN.
+    """
+    for col, value in values.items():
+        if col in df.columns:
+            dtype = df[col].dtype
+            if isinstance(dtype, pd.CategoricalDtype):
+                value = str(value)
+                if value not in dtype.categories:
+                    df[col] = df[col].cat.add_categories([value])
+            elif pd.api.types.is_datetime64_any_dtype(dtype):
+                value = pd.NaT if value in (None, "") else pd.Timestamp(value)
+            elif pd.api.types.is_integer_dtype(dtype):
+                value = int(value)
+            elif pd.api.types.is_float_dtype(dtype):
+                value = float("nan") if value in (None, "") else float(value)
+        df.loc[rows, col] = value
+
+
+def _quote_columns(cols):
+    return ", ".join(f'"{c}"' for c in cols)
+
+
+def _as_list(value):
+    if value is None:
+        return None
+    if isinstance(value, (str, int)):
+        return [str(value)]
+    return [str(v) for v in value]
+
+
+class TradeQuery:
+    """
+    Filters, projection and ordering for a trades read. Backends with
+    supports_queries evaluate it at the source (query_trades); otherwise
+    apply() runs it on the loaded table.
+    date_from/date_to are inclusive "YYYY-MM-DD" days and apply to date_field
+    (EntryDate or ExitDate); trades without that date never match a bound.
+    """
+    DATE_FIELDS = ("EntryDate", "ExitDate")
+
+    def __init__(self, accounts=None, status=None, symbols=None, strategies=None,
+                 date_from=None, date_to=None, date_field="ExitDate",
+                 columns=None, sort=None, descending=False, limit=None):
+        if date_field not in self.DATE_FIELDS:
+            raise ValueError(f"date_field must be one of {self.DATE_FIELDS}")
+        self.accounts = _as_list(accounts)
+        self.status = status
+        self.symbols = _as_list(symbols)
+        self.strategies = _as_list(strategies)
+        self.date_from = date_from
+        self.date_to = date_to
+        self.date_field = date_field
+        self.columns = list(columns) if columns else None
+        self.sort = [sort] if isinstance(sort, str) else (list(sort) if sort else None)
+        self.descending = descending
+        self.limit = limit
+
+    def apply(self, df):
+        """Evaluates the query on a DataFrame holding the whole table (returns a new frame)."""
+        if df.empty:
+            return df.copy()
+        mask = pd.Series(True, index=df.index)
+        if self.accounts is not None:
+            mask &= df['AccountID'].isin(self.accounts)
+        if self.status:
+            mask &= df['Status'] == self.status
+        if self.symbols is not None:
+            mask &= df['Symbol'].isin(self.symbols)
+        if self.strategies is not None:
+            mask &= df['Strategy'].isin(self.strategies)
+        if self.date_from or self.date_to:
+            # No-op on typed tables (see apply_trade_schema); NaT fails both bounds
+            dates = pd.to_datetime(df[self.date_field], errors="coerce", format="ISO8601")
+            if self.date_from:
+                mask &= dates >= pd.Timestamp(self.date_from)
+            if self.date_to:
+                mask &= dates < pd.Timestamp(self.date_to) + pd.Timedelta(days=1)
+        df = df[mask]
+        if self.sort:
+            # Categoricals sort by category order, which follows insertion; sort their text instead
+            as_text = lambda s: s.astype(str) if isinstance(s.dtype, pd.CategoricalDtype) else s
+            df = df.sort_values(self.sort, ascending=not self.descending, kind="stable", key=as_text)
+        if self.limit is not None:
+            df = df.head(self.limit)
+        if self.columns:
+            df = df[[c for c in self.columns if c in df.columns]]
+        return df
+
+
+class StorageBackend:
+    """
+    Where TradeManager keeps its two tables. Tables are addressed by the
+    ACCOUNTS_FILE / TRADES_FILE keys regardless of the backend.
+    Subclasses must implement read_table, write_table, signature and init_tables;
+    write_changes defaults to a full rewrite.
+    """
+    # True if the backend can evaluate a TradeQuery at the source (see query_trades)
+    supports_queries = False
+
+    def query_trades(self, query):
+        # Only called when supports_queries is True
+        raise NotImplementedError
+
+    def init_tables(self):
+        raise NotImplementedError
+
+    def read_table(self, table):
+        raise NotImplementedError
+
+    def delete_account_trades(self, account_id):
+        """
+        Deletes every trade of one account in a single step and returns how many,
+        or None if the backend can't (the trades then stay behind as orphans).
+        """
+        return None
+
+    def write_table(self, table, df):
+        raise NotImplementedError
+
+    def signature(self, table, force=False):
+        # Changes whenever the stored table may have changed (None = unknown)
+        raise NotImplementedError
+
+    def read_meta(self, key, default=None):
+        # Small persisted key/value settings (e.g. the TradeID counter)
+        raise NotImplementedError
+
+    def write_meta(self, key, value):
+        raise NotImplementedError
+
+    def write_changes(self, table, df, base_rows, updated, rewrite):
+        """
+        Commits one table's pending changes in a single step.
+        - df: the table after all changes (stored rows first, in storage order)
+        - base_rows: how many rows were stored before; df rows past it are appended
+        - updated: {row label: set of columns} changed among the stored rows
+        - rewrite: rows were removed/reordered or the header changed
+        """
+        self.write_table(table, df)
+
+
+class CSVBackend(StorageBackend):
+    def __init__(self, trades_file=TRADES_FILE, accounts_file=ACCOUNTS_FILE, meta_file=META_FILE):
+        self.paths = {TRADES_FILE: trades_file, ACCOUNTS_FILE: accounts_file}
+        self.meta_file = meta_file
+
+    def init_tables(self):
+        for table, cols in [(ACCOUNTS_FILE, ACCOUNT_COLUMNS), (TRADES_FILE, TRADE_COLUMNS)]:
+            if not os.path.exists(self.paths[table]):
+                pd.DataFrame(columns=cols).to_csv(self.paths[table], index=False)
+
+    def read_table(self, table):
+        if os.path.exists(self.paths[table]):
+            return pd.read_csv(self.paths[table], dtype=TRADE_TEXT_COLUMNS if table == TRADES_FILE else ACCOUNT_TEXT_COLUMNS)
+        return pd.DataFrame()
+
+    def write_table(self, table, df):
+        self._write_file(self.paths[table], df)
+
+    @staticmethod
+    def _write_file(path, df):
+        # Temp file + rename so readers never see a half-written table
+        tmp_path = path + ".tmp"
+        df.to_csv(tmp_path, index=False, date_format="%Y-%m-%d")
+        os.replace(tmp_path, path)
+
+    def write_changes(self, table, df, base_rows, updated, rewrite):
+        if rewrite or updated or base_rows == 0 or len(df) > base_rows + 1:
+            # CSV has no in-place update; a multi-row append is rewritten too, since a
+            # crash halfway through appending would leave part of the batch behind
+            self.write_table(table, df)
+        elif len(df) > base_rows:
+            # One short line: appended in a single write
+            df.iloc[base_rows:].to_csv(self.paths[table], mode='a', header=False, index=False, date_format="%Y-%m-%d")
+
+    def signature(self, table, force=False):
+        try:
+            st_ = os.stat(self.paths[table])
+            return (st_.st_mtime_ns, st_.st_size)
+        except OSError:
+            return None
+
+    def _read_meta_file(self):
+        try:
+            with open(self.meta_file, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def read_meta(self, key, default=None):
+        return self._read_meta_file().get(key, default)
+
+    def write_meta(self, key, value):
+        meta = self._read_meta_file()
+        meta[key] = value
+        tmp_path = self.meta_file + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self.meta_file)
+
+
+class PartitionedCSVBackend(CSVBackend):
+    """
+    CSV journal with the trades table split by temperature:
+
+        trades_open.csv    open positions (hot, stays small)
+        trades_YYYY.csv    closed trades by exit year (cold)
+
+    Open-position reads touch only the hot file and history reads only the
+    years overlapping the requested exit dates (query_trades). Writes
+    rewrite just the partitions whose rows changed, so closing a trade moves
+    one row from the hot file to its year. An existing trades.csv is split
+    on first use and then no longer read.
+    """
+    supports_queries = True
+    OPEN = "open"
+
+    def __init__(self, trades_file=TRADES_FILE, accounts_file=ACCOUNTS_FILE, meta_file=META_FILE):
+        super().__init__(trades_file, accounts_file, meta_file)
+        self.prefix = os.path.splitext(trades_file)[0] + "_"
+        self._cache = {}  # partition -> (file signature, raw frame)
+        self._layout = None  # TradeID (int) -> partition, as last read/written
+        self._columns = None  # trades header, as last read/written
+        self._lock = threading.RLock()
+
+    def _path(self, part):
+        return f"{self.prefix}{part}.csv"
+
+    def _partitions(self):
+        parts = []
+        for path in glob.glob(self._path("*")):
+            part = path[len(self.prefix):-len(".csv")]
+            if part == self.OPEN or part.isdigit():
+                parts.append(part)
+        # Years ascending, hot partition last
+        return sorted(parts, key=lambda p: (p == self.OPEN, p))
+
+    def _partition_of(self, df):
+        # Open trades -> hot; closed -> exit year (entry year if the exit date is missing)
+        exit_year = pd.to_datetime(df['ExitDate'], errors="coerce", format="ISO8601").dt.year
+        entry_year = pd.to_datetime(df['EntryDate'], errors="coerce", format="ISO8601").dt.year
+        year = exit_year.fillna(entry_year).fillna(0).astype(int).where(df['Status'] != "Open", -1)
+        return year.map({y: self.OPEN if y == -1 else str(y) for y in year.unique()})
+
+    def _layout_of(self, df, labels=None):
+        if df.empty:
+            return {}
+        labels = self._partition_of(df) if labels is None else labels
+        return dict(zip(pd.to_numeric(df['TradeID'], errors="coerce").fillna(0).astype(int), labels))
+
+    def _file_sig(self, part):
+        try:
+            st_ = os.stat(self._path(part))
+            return (st_.st_mtime_ns, st_.st_size)
+        except OSError:
+            return None
+
+    def _read_partition(self, part):
+        with self._lock:
+            sig = self._file_sig(part)
+            cached = self._cache.get(part)
+            if cached is not None and cached[0] == sig:
+                return cached[1]
+            df = pd.read_csv(self._path(part), dtype=TRADE_TEXT_COLUMNS) if sig is not None else pd.DataFrame()
+            self._cache[part] = (sig, df)
+            return df
+
+    def _read_partitions(self, parts):
+        frames = [df for df in (self._read_partition(p) for p in parts) if not df.empty]
+        if not frames:
+            return pd.DataFrame(columns=TRADE_COLUMNS)
+        df = pd.concat(frames, ignore_index=True)
+        # Partition boundaries are not storage order: present trades in TradeID order
+        ids = pd.to_numeric(df['TradeID'], errors="coerce")
+        return df.iloc[ids.argsort(kind="stable")].reset_index(drop=True)
+
+    def init_tables(self):
+        with self._lock:
+            if not os.path.exists(self.paths[ACCOUNTS_FILE]):
+                pd.DataFrame(columns=ACCOUNT_COLUMNS).to_csv(self.paths[ACCOUNTS_FILE], index=False)
+            legacy = self.paths[TRADES_FILE]
+            if not self._partitions() and os.path.exists(legacy):
+                df = pd.read_csv(legacy, dtype=TRADE_TEXT_COLUMNS)
+                if not df.empty:
+                    self.write_table(TRADES_FILE, df)
+
+    def read_table(self, table):
+        if table != TRADES_FILE:
+            return super().read_table(table)
+        with self._lock:
+            df = self._read_partitions(self._partitions())
+            self._layout = self._layout_of(df)
+            self._columns = list(df.columns)
+            return df
+
+    def query_trades(self, query):
+        """Evaluates a TradeQuery on the partitions it can match only."""
+        parts = self._partitions()
+        if query.status == "Open":
+            parts = [p for p in parts if p == self.OPEN]
+        elif query.status == "Closed":
+            parts = [p for p in parts if p != self.OPEN]
+        if query.date_field == "ExitDate" and (query.date_from or query.date_to):
+            # Open trades have no exit date; closed ones live in their exit year
+            first = pd.Timestamp(query.date_from).year if query.date_from else 0
+            last = pd.Timestamp(query.date_to).year if query.date_to else 9999
+            parts = [p for p in parts if p != self.OPEN and first <= int(p) <= last]
+        return query.apply(self._read_partitions(parts))
+
+    def _write_partitions(self, df, labels, parts):
+        for part in parts:
+            rows = df[labels == part]
+            if rows.empty:
+                if os.path.exists(self._path(part)):
+                    os.remove(self._path(part))
+            else:
+                self._write_file(self._path(part), rows)
+            self._cache.pop(part, None)
+
+    def write_table(self, table, df):
+        if table != TRADES_FILE:
+            return super().write_table(table, df)
+        with self._lock:
+            labels = self._partition_of(df) if not df.empty else pd.Series(dtype=object)
+            self._write_partitions(df, labels, set(labels) | set(self._partitions()))
+            self._layout = self._layout_of(df, labels)
+            self._columns = list(df.columns)
+
+    def write_changes(self, table, df, base_rows, updated, rewrite):
+        if table != TRADES_FILE:
+            return super().write_changes(table, df, base_rows, updated, rewrite)
+        with self._lock:
+            if self._layout is None or df.empty:
+                return self.write_table(table, df)
+            if list(df.columns) != self._columns:
+                # Header change: every partition gets the new columns
+                return self.write_table(table, df)
+            labels = self._partition_of(df)
+            if rewrite:
+                # Rows added, moved or removed anywhere
+                layout = self._layout_of(df, labels)
+                touched = {p for k, p in layout.items() if self._layout.get(k) != p}
+                touched |= {p for k, p in self._layout.items() if layout.get(k) != p}
+                touched |= {labels.at[idx] for idx in updated if idx in labels.index}
+                self._write_partitions(df, labels, touched)
+                self._layout = layout
+                return
+            # Appended rows + rows with changed cells, in their old and new partitions
+            rows = list(range(base_rows, len(df))) + [df.index.get_loc(idx) for idx in updated]
+            changed = {int(df['TradeID'].iat[i]): labels.iat[i] for i in rows}
+            touched = set(changed.values()) | {self._layout[k] for k in changed if k in self._layout}
+            self._write_partitions(df, labels, touched)
+            self._layout.update(changed)
+
+    def signature(self, table, force=False):
+        if table != TRADES_FILE:
+            return super().signature(table, force)
+        return tuple((p, self._file_sig(p)) for p in self._partitions())
+
+
+class SheetsBackend(StorageBackend):
+    def __init__(self, sh):
+        self.sh = sh
+        self._rev = None
+        self._rev_checked_at = 0.0
+        # Per-worksheet signature = (external epoch, own write count). The spreadsheet
+        # has one revision, so only a revision we didn't produce invalidates every table.
+        self._epoch = 0
+        self._versions = {}
+        self._rev_absorbed = False
+        # Worksheet handles are resolved once (each lookup is a metadata API call)
+        self._worksheets = {}
+        self._worksheets_lock = threading.Lock()
+
+    def _get_worksheet(self, table):
+        name = {ACCOUNTS_FILE: "Accounts", TRADES_FILE: "Trades"}.get(table, table)
+        with self._worksheets_lock:
+            if not self._worksheets:
+                # One metadata call resolves every existing worksheet
+                self._worksheets = {ws.title: ws for ws in self.sh.worksheets()}
+            ws = self._worksheets.get(name)
+            if ws is None:
+                try:
+                    ws = self.sh.add_worksheet(title=name, rows=100, cols=20)
+                except Exception:
+                    # Created elsewhere since the handles were listed
+                    ws = self.sh.worksheet(name)
+                self._worksheets[name] = ws
+            return ws
+
+    def init_tables(self):
+        # Check if worksheets exist, init headers if empty
+        for table, cols in [(ACCOUNTS_FILE, ACCOUNT_COLUMNS), (TRADES_FILE, TRADE_COLUMNS)]:
+            ws = self._get_worksheet(table)
+            # Header row only; the full table is read later, when first needed
+            if not ws.row_values(1):
+                ws.append_row(cols)
+
+    def read_table(self, table):
+        data = self._get_worksheet(table).get_all_records()
+        if not data:
+            return pd.DataFrame() # Return empty if no records
+        return pd.DataFrame(data)
+
+    def write_table(self, table, df):
+        ws = self._get_worksheet(table)
+        ws.clear()
+        # Update with header and data
+        ws.update([df.columns.values.tolist()] + [[_to_cell(v) for v in r] for r in df.itertuples(index=False, name=None)])
+        self._wrote(table)
+
+    def write_changes(self, table, df, base_rows, updated, rewrite):
+        if rewrite or base_rows == 0:
+            self.write_table(table, df)
+            return
+        
+        from gspread.utils import rowcol_to_a1
+
+        ws = self._get_worksheet(table)
+        # Changed cells of existing rows go out as one batched range update
+        updates = []
+        for idx, columns in updated.items():
+            sheet_row = df.index.get_loc(idx) + 2  # +1 for 1-based rows, +1 for the header
+            for col in columns:
+                sheet_col = df.columns.get_loc(col) + 1
+                updates.append({
+                    "range": rowcol_to_a1(sheet_row, sheet_col),
+                    "values": [[_to_cell(df.at[idx, col])]]
+                })
+        if updates:
+            ws.batch_update(updates)
+        
+        if len(df) > base_rows:
+            ws.append_rows([[_to_cell(v) for v in r] for r in df.iloc[base_rows:].itertuples(index=False, name=None)])
+        self._wrote(table)
+
+    def _fetch_revision(self):
+        try:
+            return self.sh.get_lastUpdateTime()
+        except Exception:
+            return None  # Unknown revision -> always reload
+
+    def _wrote(self, table):
+        # Our own write changed `table` only: take the revision it produced as known
+        self._versions[table] = self._versions.get(table, 0) + 1
+        self._rev = self._fetch_revision()
+        self._rev_checked_at = time.time()
+        self._rev_absorbed = True
+
+    def signature(self, table, force=False):
+        now = time.time()
+        if force and self._rev_absorbed:
+            # Revision was just read back after our own write
+            self._rev_absorbed = False
+        elif force or now - self._rev_checked_at >= SHEETS_REVISION_CHECK_INTERVAL:
+            rev = self._fetch_revision()
+            if rev is None or rev != self._rev:
+                # Changed by someone else: any worksheet may be stale
+                self._epoch += 1
+            self._rev = rev
+            self._rev_checked_at = now
+        if self._rev is None:
+            return None
+        return (self._epoch, self._versions.get(table, 0))
+
+    def read_meta(self, key, default=None):
+        for row in self._get_worksheet("Meta").get_all_values():
+            if row and row[0] == key:
+                return row[1] if len(row) > 1 else default
+        return default
+
+    def write_meta(self, key, value):
+        ws = self._get_worksheet("Meta")
+        for i, row in enumerate(ws.get_all_values(), start=1):
+            if row and row[0] == key:
+                ws.update_cell(i, 2, _to_cell(value))
+                self._wrote("Meta")
+                return
+        ws.append_row([key, _to_cell(value)])
+        self._wrote("Meta")
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    Single-file SQLite store. Trades are indexed on TradeID, (AccountID, Status)
+    and ExitDate, so per-account/status queries and single-trade updates
+    don't touch the rest of the history.
+    """
+    supports_queries = True
+
+    TABLES = {ACCOUNTS_FILE: "accounts", TRADES_FILE: "trades"}
+    KEYS = {ACCOUNTS_FILE: "AccountID", TRADES_FILE: "TradeID"}
+    COLUMN_TYPES = {
+        "TradeID": "INTEGER", "TrendScore": "INTEGER", "Quantity": "INTEGER", "UnitQuantity": "INTEGER",
+        "EntryPrice": "REAL", "StopLoss": "REAL", "RiskAmount": "REAL", "ExitPrice": "REAL",
+        "PnL": "REAL", "R_Multiple": "REAL", "InitialBalance": "REAL", "CurrentBalance": "REAL",
+    }
+
+    def __init__(self, path=SQLITE_FILE):
+        self.path = path
+        # Streamlit reruns on worker threads; all access goes through the lock
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.RLock()
+        self._in_transaction = False
+        # Called inside each write transaction as hook(conn, table, keys);
+        # keys = changed row keys, or None when the whole table was rewritten
+        self.write_hooks = []
+
+    def _run_hooks(self, table, keys):
+        for hook in self.write_hooks:
+            hook(self.conn, table, keys)
+
+    def _columns_sql(self, cols):
+        return ", ".join(f'"{c}" {self.COLUMN_TYPES.get(c, "TEXT")}' for c in cols)
+
+    def init_tables(self):
+        with self._lock, self.conn:
+            self.conn.execute(f"CREATE TABLE IF NOT EXISTS accounts ({self._columns_sql(ACCOUNT_COLUMNS)})")
+            self.conn.execute(f"CREATE TABLE IF NOT EXISTS trades ({self._columns_sql(TRADE_COLUMNS)})")
+            self.conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_accounts_id ON accounts (AccountID)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_trades_id ON trades (TradeID)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_trades_account_status ON trades (AccountID, Status)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_trades_exit_date ON trades (ExitDate)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_trades_symbol ON trades (Symbol)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def _existing_columns(self, name):
+        return [r[1] for r in self.conn.execute(f'PRAGMA table_info("{name}")')]
+
+    def _ensure_columns(self, name, cols):
+        existing = self._existing_columns(name)
+        for c in cols:
+            if c not in existing:
+                self.conn.execute(f'ALTER TABLE "{name}" ADD COLUMN {self._columns_sql([c])}')
+
+    def read_table(self, table):
+        with self._lock:
+            return pd.read_sql_query(f'SELECT * FROM "{self.TABLES[table]}" ORDER BY rowid', self.conn)
+
+    def query_trades(self, query):
+        """Runs a TradeQuery as one indexed SELECT (filters, projection, ORDER BY, LIMIT)."""
+        clauses, params = [], []
+        def member(column, values):
+            clauses.append(f'"{column}" IN ({", ".join("?" * len(values))})' if values else "0")
+            params.extend(values)
+        
+        if query.accounts is not None:
+            member("AccountID", query.accounts)
+        if query.status:
+            clauses.append("Status = ?")
+            params.append(query.status)
+        if query.symbols is not None:
+            member("Symbol", query.symbols)
+        if query.strategies is not None:
+            member("Strategy", query.strategies)
+        if query.date_from:
+            clauses.append(f'"{query.date_field}" >= ?')
+            params.append(str(query.date_from))
+        if query.date_to:
+            clauses.append(f'"{query.date_field}" <= ? AND "{query.date_field}" != \'\'')
+            params.append(str(query.date_to))
+        
+        with self._lock:
+            existing = self._existing_columns("trades")
+            select = "*"
+            if query.columns:
+                select = _quote_columns([c for c in query.columns if c in existing]) or "*"
+            direction = "DESC" if query.descending else "ASC"
+            order = ", ".join([f'"{c}" {direction}' for c in (query.sort or []) if c in existing] + ["rowid"])
+            sql = f"SELECT {select} FROM trades"
+            if clauses:
+                sql += f" WHERE {' AND '.join(clauses)}"
+            sql += f" ORDER BY {order}"
+            if query.limit is not None:
+                sql += " LIMIT ?"
+                params.append(int(query.limit))
+            return pd.read_sql_query(sql, self.conn, params=params)
+
+    def delete_account_trades(self, account_id):
+        # One indexed DELETE (idx_trades_account_status) instead of rewriting the table
+        with self._lock, self.conn:
+            keys = [str(r[0]) for r in self.conn.execute("SELECT TradeID FROM trades WHERE AccountID = ?", (account_id,))]
+            if keys:
+                self.conn.execute("DELETE FROM trades WHERE AccountID = ?", (account_id,))
+                self._run_hooks(TRADES_FILE, keys)
+        return len(keys)
+
+    def _insert_sql(self, name, cols):
+        return f'INSERT INTO "{name}" ({_quote_columns(cols)}) VALUES ({", ".join("?" * len(cols))})'
+
+    def _rows(self, df):
+        return [[_to_cell(v) for v in r] for r in df.itertuples(index=False, name=None)]
+
+    def write_table(self, table, df):
+        name = self.TABLES[table]
+        with self._lock, self.conn:
+            self._ensure_columns(name, list(df.columns))
+            self.conn.execute(f'DELETE FROM "{name}"')
+            if not df.empty:
+                self.conn.executemany(self._insert_sql(name, list(df.columns)), self._rows(df))
+            self._run_hooks(table, None)
+
+    def write_changes(self, table, df, base_rows, updated, rewrite):
+        key = self.KEYS[table]
+        if rewrite or any(key in cols for cols in updated.values()):
+            # Row keys changed; tables keyed this way (accounts) are small
+            self.write_table(table, df)
+            return
+        
+        name = self.TABLES[table]
+        # Single transaction: keyed single-row UPDATEs + INSERTs for new rows
+        with self._lock, self.conn:
+            self._ensure_columns(name, list(df.columns))
+            for idx, columns in updated.items():
+                columns = list(columns)
+                assignments = ", ".join(f'"{c}" = ?' for c in columns)
+                self.conn.execute(f'UPDATE "{name}" SET {assignments} WHERE "{key}" = ?',
+                                  [_to_cell(df.at[idx, c]) for c in columns] + [_to_cell(df.at[idx, key])])
+            if len(df) > base_rows:
+                self.conn.executemany(self._insert_sql(name, list(df.columns)), self._rows(df.iloc[base_rows:]))
+            if self.write_hooks:
+                changed = [df.at[idx, key] for idx in updated] + df[key].iloc[base_rows:].tolist()
+                self._run_hooks(table, [str(_to_cell(k)) for k in changed])
+
+    @contextmanager
+    def transaction(self):
+        """
+        Groups several calls (upsert_rows, delete_rows, statements on the
+        yielded connection) into one transaction.
+        """
+        with self._lock:
+            if self._in_transaction:
+                yield self.conn
+                return
+            self._in_transaction = True
+            try:
+                with self.conn:
+                    yield self.conn
+            finally:
+                self._in_transaction = False
+
+    def upsert_rows(self, table, df):
+        """Replaces rows by key (inserting new keys). Does not run write hooks."""
+        if df.empty:
+            return
+        name, key = self.TABLES[table], self.KEYS[table]
+        with self.transaction() as conn:
+            self._ensure_columns(name, list(df.columns))
+            conn.executemany(f'DELETE FROM "{name}" WHERE "{key}" = ?', [[_to_cell(k)] for k in df[key]])
+            conn.executemany(self._insert_sql(name, list(df.columns)), self._rows(df))
+
+    def delete_rows(self, table, keys):
+        """Deletes rows by key. Does not run write hooks."""
+        name, key = self.TABLES[table], self.KEYS[table]
+        with self.transaction() as conn:
+            conn.executemany(f'DELETE FROM "{name}" WHERE "{key}" = ?', [[k] for k in keys])
+
+    def signature(self, table, force=False):
+        # data_version only moves when *another* connection commits, which is
+        # exactly when our write-through copy can be out of date
+        with self._lock:
+            return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def read_meta(self, key, default=None):
+        with self._lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def write_meta(self, key, value):
+        with self._lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(_to_cell(value))))
+
+
+def migrate_csv_to_sqlite(db_path=SQLITE_FILE, trades_file=TRADES_FILE, accounts_file=ACCOUNTS_FILE,
+                          meta_file=META_FILE):
+    """Imports existing CSV tables and meta counters into a SQLite journal (replacing its contents)."""
+    src = CSVBackend(trades_file, accounts_file, meta_file)
+    dst = SQLiteBackend(db_path)
+    dst.init_tables()
+    counts = {}
+    for table in (ACCOUNTS_FILE, TRADES_FILE):
+        df = src.read_table(table)
+        if df.empty:
+            df = pd.DataFrame(columns=ACCOUNT_COLUMNS if table == ACCOUNTS_FILE else TRADE_COLUMNS)
+        dst.write_table(table, df)
+        counts[table] = len(df)
+    # Without the counters, IDs of deleted trades/accounts would be handed out again
+    for key in META_KEYS:
+        value = src.read_meta(key)
+        if value is not None:
+            dst.write_meta(key, value)
+    return counts
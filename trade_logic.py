@@ -1,33 +1,639 @@
-
-try:
-    import gspread
-    from oauth2client.service_account import ServiceAccountCredentials
-    HAS_GSHEETS = True
-except ImportError:
-    HAS_GSHEETS = False
-
 import streamlit as st
+import functools
+import importlib.util
 import json
 import os
+import numpy as np
 import pandas as pd
-import FinanceDataReader as fdr
-from datetime import datetime
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+
+from profiling import PROFILER, frame_bytes
+from storage import (
+    ACCOUNTS_FILE, TRADES_FILE, SQLITE_FILE, TRADE_COLUMNS, ACCOUNT_KEY_PREFIX,
+    CSVBackend, PartitionedCSVBackend, SheetsBackend, SQLiteBackend, TradeQuery,
+    apply_trade_schema, concat_trades, set_trade_cells,
+)
+
+# gspread/oauth2client and FinanceDataReader are slow to import; they load on first use
+HAS_GSHEETS = all(importlib.util.find_spec(m) is not None for m in ("gspread", "oauth2client"))
+
+# Storage backend override: "csv" | "partitioned" (CSV split into open/yearly trade files)
+# | "sqlite" | "gsheets" | "sync" (local SQLite replicated to Sheets)
+# (default: Sheets if configured, else CSV)
+BACKEND_ENV = "JOURNAL_BACKEND"
+SQLITE_PATH_ENV = "JOURNAL_DB"
+
+STOCK_LISTING_FILE = "krx_listing.json"
+# After a failed listing download, wait this long (seconds) before trying again
+STOCK_LISTING_RETRY_INTERVAL = 300
+
+# Local daily OHLC store: one CSV per symbol, first download covers this many days
+OHLC_DIR = "ohlc"
+OHLC_INITIAL_DAYS = 400
+OHLC_COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+# KRX regular session (local time); a bar stored after the close is final for the day
+MARKET_OPEN = (9, 0)
+MARKET_CLOSE = (15, 30)
+
+# Background quote prefetch (seconds): interval while the market is open (env override),
+# then doubling from the closed interval up to the max while it is closed
+QUOTE_PREFETCH_ENV = "JOURNAL_QUOTE_INTERVAL"
+QUOTE_PREFETCH_INTERVAL = 30
+QUOTE_PREFETCH_CLOSED_INTERVAL = 300
+QUOTE_PREFETCH_MAX_INTERVAL = 3600
+
+# Quote fetching (bounded pool, per-symbol time budget in seconds)
+QUOTE_MAX_WORKERS = 8
+QUOTE_TIMEOUT = 10
+
+# Quote cache (seconds fresh, extra seconds servable while refreshing, max symbols)
+QUOTE_CACHE_TTL = 60
+QUOTE_CACHE_STALE_TTL = 600
+QUOTE_CACHE_SIZE = 512
+
+# Kiwoom fee model: 0.015% commission on buy & sell (floored to 10 won), 0.20% tax on sell (floored to 1 won)
+FEE_RATE = 0.00015
+TAX_RATE = 0.002
+
+
+# Share of capital deployed per market trend score (3=up, 2=sideways, 1=down)
+TREND_FACTORS = {3: 1.0, 2: 0.6666, 1: 0.3333}
+
+def normalize_symbol(symbol):
+    # KRX fallback and zero-padding logic
+    target_symbol = str(symbol)
+    if target_symbol.isdigit() and len(target_symbol) < 6:
+        target_symbol = target_symbol.zfill(6)
+    return target_symbol
+
+
+def calculate_pnl(entry_prices, quantities, mark_prices, stop_losses=None):
+    """
+    Vectorized fee/tax and P&L for whole columns of positions.
+    Inputs are array-likes (Series keep their index). Returns a DataFrame with
+    EntryAmount, MarkAmount, BuyFee, SellFee, Tax, Fee, GrossPnL, NetPnL, R_Multiple.
+    R_Multiple is 0 where stop_losses is omitted or equals the entry price.
+    """
+    index = entry_prices.index if isinstance(entry_prices, pd.Series) else None
+    entry = np.asarray(entry_prices, dtype=float)
+    qty = np.asarray(quantities, dtype=float)
+    mark = np.asarray(mark_prices, dtype=float)
+    
+    entry_amt = entry * qty
+    mark_amt = mark * qty
+    
+    buy_fee = np.floor((entry_amt * FEE_RATE) / 10) * 10
+    sell_fee = np.floor((mark_amt * FEE_RATE) / 10) * 10
+    tax = np.floor(mark_amt * TAX_RATE)
+    fee = buy_fee + sell_fee + tax
+    
+    gross_pnl = mark_amt - entry_amt
+    net_pnl = gross_pnl - fee
+    
+    if stop_losses is None:
+        r_mult = np.zeros_like(entry)
+    else:
+        risk_dist = np.abs(entry - np.asarray(stop_losses, dtype=float))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r_mult = np.where(risk_dist != 0, (mark - entry) / risk_dist, 0.0)
+    
+    return pd.DataFrame({
+        "EntryAmount": entry_amt,
+        "MarkAmount": mark_amt,
+        "BuyFee": buy_fee,
+        "SellFee": sell_fee,
+        "Tax": tax,
+        "Fee": fee,
+        "GrossPnL": gross_pnl,
+        "NetPnL": net_pnl,
+        "R_Multiple": r_mult,
+    }, index=index)
+
+
+class QuoteCache:
+    """
+    Process-wide symbol -> price cache shared by every TradeManager.
+    - Fresh (age < ttl): served from memory
+    - Stale (age < ttl + stale_ttl): served from memory, refreshed in the background
+    - Older / missing: fetched synchronously
+    Least recently used symbols are evicted beyond max_size.
+    """
+    def __init__(self, ttl=QUOTE_CACHE_TTL, stale_ttl=QUOTE_CACHE_STALE_TTL, max_size=QUOTE_CACHE_SIZE):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_size = max_size
+        self._data = OrderedDict()  # symbol -> (price, fetched_at)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get(self, symbol, loader):
+        key = normalize_symbol(symbol)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                price, fetched_at = entry
+                age = time.time() - fetched_at
+                if age < self.ttl + self.stale_ttl:
+                    self._data.move_to_end(key)
+                    if age >= self.ttl and key not in self._refreshing:
+                        self._refreshing.add(key)
+                        threading.Thread(target=PROFILER.bind(self._revalidate), args=(key, loader), daemon=True).start()
+                    return price
+        
+        price = loader(key)
+        self.put(key, price)
+        return price
+
+    def put(self, symbol, price):
+        # Failed fetches are not cached so the next call retries
+        if price is None:
+            return
+        key = normalize_symbol(symbol)
+        with self._lock:
+            self._data[key] = (price, time.time())
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, symbols=None):
+        with self._lock:
+            if symbols is None:
+                self._data.clear()
+            else:
+                for s in symbols:
+                    self._data.pop(normalize_symbol(s), None)
+
+    def _revalidate(self, key, loader):
+        try:
+            self.put(key, loader(key))
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+
+QUOTE_CACHE = QuoteCache()
+
+
+def market_is_open(now=None):
+    now = now or datetime.now()
+    return now.weekday() < 5 and MARKET_OPEN <= (now.hour, now.minute) < MARKET_CLOSE
+
+
+def size_positions(capital, entry_prices, sl_pcts, risk_pcts, trend_scores=(3,), deposit=None):
+    """
+    Vectorized what-if grid for TradeManager.calculate_position.
+    Every combination of entry price x stop-loss % x risk % x trend score is
+    sized in one pass. Returns a long DataFrame (one row per scenario) with
+    EntryPrice, StopLossPct, RiskPct, TrendScore, StopLoss, AdjustedCapital,
+    RiskAmount, SLDist, TotalQty, UnitQty, CapitalRequired and Fits
+    (CapitalRequired <= deposit; always True without a deposit).
+    Scenarios with a zero stop distance get quantity 0.
+    """
+    entry, sl_pct, risk_pct, trend = (
+        a.ravel() for a in np.meshgrid(
+            np.asarray(entry_prices, dtype=float), np.asarray(sl_pcts, dtype=float),
+            np.asarray(risk_pcts, dtype=float), np.asarray(trend_scores, dtype=int), indexing="ij")
+    )
+    trend_factor = np.array([TREND_FACTORS.get(t, 1.0) for t in trend])
+    adjusted_capital = capital * trend_factor
+    risk_amount = adjusted_capital * (risk_pct / 100.0)
+    stop_loss = entry * (1 - sl_pct / 100.0)
+    sl_dist = np.abs(entry - stop_loss)
+    
+    with np.errstate(divide="ignore", invalid="ignore"):
+        total_qty = np.where(sl_dist > 0, np.floor(risk_amount / sl_dist), 0).astype(np.int64)
+    capital_required = total_qty * entry
+    fits = np.ones(len(entry), dtype=bool) if deposit is None else capital_required <= deposit
+    
+    return pd.DataFrame({
+        "EntryPrice": entry,
+        "StopLossPct": sl_pct,
+        "RiskPct": risk_pct,
+        "TrendScore": trend,
+        "StopLoss": stop_loss,
+        "AdjustedCapital": adjusted_capital.astype(np.int64),
+        "RiskAmount": risk_amount.astype(np.int64),
+        "SLDist": sl_dist,
+        "TotalQty": total_qty,
+        "UnitQty": total_qty // 3,
+        "CapitalRequired": capital_required,
+        "Fits": fits,
+    })
+
+
+def last_trading_day(now=None):
+    # Weekends roll back to Friday (exchange holidays are not tracked)
+    day = (now or datetime.now()).date()
+    while day.weekday() >= 5:
+        day -= timedelta(days=1)
+    return day
+
+
+class StockListingCache:
+    """
+    Process-wide KRX code -> name map, persisted to a local JSON file.
+    The file is reused until a new trading day starts, then refreshed in
+    the background; lookups never wait on the download.
+    """
+    def __init__(self, path=STOCK_LISTING_FILE):
+        self.path = path
+        self._names = None
+        self._as_of = None
+        self._refreshing = False
+        self._failed_at = None
+        self._lock = threading.Lock()
+
+    def get(self, code):
+        self._ensure_loaded()
+        names = self._names
+        return names.get(code) if names else None
+
+    def get_many(self, codes):
+        self._ensure_loaded()
+        names = self._names or {}
+        return {code: names.get(code) for code in codes}
+
+    def is_ready(self):
+        self._ensure_loaded()
+        return self._names is not None
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if self._names is None and self._as_of is None:
+                self._load_file()
+            stale = self._as_of is None or self._as_of < last_trading_day()
+            backing_off = (self._failed_at is not None
+                           and time.monotonic() - self._failed_at < STOCK_LISTING_RETRY_INTERVAL)
+            if stale and not self._refreshing and not backing_off:
+                self._refreshing = True
+                threading.Thread(target=self._refresh, daemon=True).start()
+
+    def _load_file(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                payload = json.load(f)
+            self._names = payload["names"]
+            self._as_of = datetime.strptime(payload["as_of"], "%Y-%m-%d").date()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Ignoring unreadable stock listing cache: {e}")
+
+    def _refresh(self):
+        try:
+            import FinanceDataReader as fdr
+            
+            # Cache KRX listing (covers KOSPI, KOSDAQ)
+            df_krx = fdr.StockListing('KRX')
+            names = df_krx[['Code', 'Name']].set_index('Code')['Name'].to_dict()
+            as_of = datetime.now().date()
+            
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"as_of": as_of.strftime("%Y-%m-%d"), "names": names}, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+            
+            with self._lock:
+                self._names = names
+                self._as_of = as_of
+                self._failed_at = None
+        except Exception as e:
+            print(f"Error refreshing stock listing: {e}")
+            with self._lock:
+                self._failed_at = time.monotonic()
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+
+STOCK_LISTING = StockListingCache()
+
+
+class OHLCStore:
+    """
+    Per-symbol daily bars kept on disk ({root}/{symbol}.csv).
+    An update downloads only the range from the last stored bar onward
+    (re-fetching that bar, which may have been intraday). Once the last
+    trading day's closing bar is stored the symbol needs no network at all;
+    when a download fails the stored history is served as-is.
+    """
+    def __init__(self, root=OHLC_DIR):
+        self.root = root
+        self._frames = {}
+        self._fetched_at = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _path(self, symbol):
+        return os.path.join(self.root, f"{symbol}.csv")
+
+    def _symbol_lock(self, symbol):
+        with self._lock:
+            return self._locks.setdefault(symbol, threading.Lock())
+
+    def _read(self, symbol):
+        # Memory first, then disk; returns (bars, last write time)
+        if symbol not in self._frames:
+            path = self._path(symbol)
+            try:
+                df = pd.read_csv(path, index_col="Date", parse_dates=["Date"])
+                self._frames[symbol] = df
+                self._fetched_at[symbol] = datetime.fromtimestamp(os.path.getmtime(path))
+            except FileNotFoundError:
+                return None, None
+            except Exception as e:
+                print(f"Ignoring unreadable price history for {symbol}: {e}")
+                return None, None
+        return self._frames[symbol], self._fetched_at[symbol]
+
+    def _write(self, symbol, df):
+        os.makedirs(self.root, exist_ok=True)
+        path = self._path(symbol)
+        tmp_path = path + ".tmp"
+        df.to_csv(tmp_path, index_label="Date")
+        os.replace(tmp_path, path)
+        self._frames[symbol] = df
+        self._fetched_at[symbol] = datetime.now()
+
+    def is_fresh(self, symbol, now=None):
+        # Fresh = the last trading day's bar was stored after that day's close
+        df, fetched_at = self._read(normalize_symbol(symbol))
+        if df is None or df.empty:
+            return False
+        now = now or datetime.now()
+        day = last_trading_day(now)
+        if day == now.date() and (now.hour, now.minute) < MARKET_OPEN:
+            # Before the open, the previous session's bar is the latest there is
+            day = last_trading_day(now - timedelta(days=1))
+        closed_at = datetime.combine(day, datetime.min.time()).replace(hour=MARKET_CLOSE[0], minute=MARKET_CLOSE[1])
+        return df.index[-1].date() >= day and fetched_at >= closed_at
+
+    def update(self, symbol):
+        """Fetches the missing bars for `symbol`; returns the full stored history (or None)."""
+        symbol = normalize_symbol(symbol)
+        with self._symbol_lock(symbol):
+            df, _ = self._read(symbol)
+            if df is not None and not df.empty:
+                start = df.index[-1]
+            else:
+                start = datetime.now() - timedelta(days=OHLC_INITIAL_DAYS)
+            try:
+                import FinanceDataReader as fdr
+                with PROFILER.span("fdr.DataReader", symbol=symbol) as ev:
+                    new = fdr.DataReader(symbol, start=start.strftime("%Y-%m-%d"))
+                    ev["bytes_read"] = frame_bytes(new)
+            except Exception as e:
+                print(f"Error fetching price history for {symbol}: {e}")
+                return df
+            if new is None or new.empty:
+                return df
+            new = new[[c for c in OHLC_COLUMNS if c in new.columns]]
+            new.index = pd.to_datetime(new.index).rename("Date")
+            if df is not None and not df.empty:
+                new = pd.concat([df[df.index < new.index[0]], new])
+            self._write(symbol, new)
+            return new
+
+    def history(self, symbol, start=None, refresh=True):
+        """Daily bars from the store, updated first unless fresh (or refresh=False)."""
+        symbol = normalize_symbol(symbol)
+        if refresh and not self.is_fresh(symbol):
+            df = self.update(symbol)
+        else:
+            df, _ = self._read(symbol)
+        if df is None:
+            return pd.DataFrame(columns=OHLC_COLUMNS)
+        if start is not None:
+            df = df[df.index >= pd.Timestamp(start)]
+        return df
+
+    def last_close(self, symbol):
+        df = self.history(symbol)
+        if df.empty:
+            return None
+        return float(df['Close'].iloc[-1])
+
+
+OHLC_STORE = OHLCStore()
+
+
+class QuotePrefetcher:
+    """
+    One background worker per process that keeps marks for every open
+    position fresh and publishes them as a shared snapshot
+    {symbol: (price, fetched_at)}. Page renders read the snapshot and never
+    wait on the network; symbols they miss are queued for the next cycle.
+    """
+    def __init__(self, interval=None, closed_interval=QUOTE_PREFETCH_CLOSED_INTERVAL,
+                 max_interval=QUOTE_PREFETCH_MAX_INTERVAL):
+        self.interval = interval or float(os.environ.get(QUOTE_PREFETCH_ENV, QUOTE_PREFETCH_INTERVAL))
+        self.closed_interval = closed_interval
+        self.max_interval = max_interval
+        self._snapshot = {}
+        self._wanted = set()
+        self._thread = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self, tm):
+        # Idempotent: the first caller's TradeManager supplies the open symbols
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, args=(tm,), daemon=True, name="quote-prefetch")
+            self._thread.start()
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def snapshot(self, symbols):
+        """Returns ({symbol: price}, oldest fetch time) for the symbols found; queues the rest."""
+        snap = self._snapshot
+        prices, missing, as_of = {}, [], None
+        for s in symbols:
+            entry = snap.get(normalize_symbol(s))
+            if entry is None:
+                missing.append(normalize_symbol(s))
+                continue
+            prices[s] = entry[0]
+            as_of = entry[1] if as_of is None else min(as_of, entry[1])
+        if missing:
+            with self._lock:
+                self._wanted.update(missing)
+            self._wake.set()
+        return prices, as_of
+
+    def publish(self, prices):
+        # Copy-on-write so readers never see a half-updated dict
+        now = datetime.now()
+        snap = dict(self._snapshot)
+        for s, price in prices.items():
+            if price is not None:
+                snap[normalize_symbol(s)] = (price, now)
+        self._snapshot = snap
+
+    def _run(self, tm):
+        closed_delay = None
+        while True:
+            PROFILER.activate_background(worker="quote-prefetch")
+            try:
+                open_trades = tm.get_trades(status="Open")
+                symbols = set() if open_trades.empty else set(open_trades['Symbol'].map(normalize_symbol))
+                with self._lock:
+                    symbols |= self._wanted
+                    self._wanted.clear()
+                if symbols:
+                    tm.refresh_quotes(symbols)
+            except Exception as e:
+                print(f"Quote prefetch failed: {e}")
+            
+            if market_is_open():
+                closed_delay = None
+                delay = self.interval
+            else:
+                # Marks don't move after the close: back off exponentially
+                closed_delay = self.closed_interval if closed_delay is None else min(closed_delay * 2, self.max_interval)
+                delay = closed_delay
+            self._wake.wait(delay)
+            self._wake.clear()
+
+
+QUOTE_PREFETCHER = QuotePrefetcher()
+
+
+class _PendingTable:
+    # Uncommitted changes to one table (see TradeManager._stage)
+    def __init__(self, base_rows):
+        self.base_rows = base_rows
+        self.df = None
+        self.updated = {}
+        self.rewrite = False
+
+
+_SHEETS_CONNECTION = None
+_SHEETS_CONNECTION_LOCK = threading.Lock()
+
+
+def _open_spreadsheet():
+    """
+    Authorized gspread client and the journal spreadsheet, shared by the
+    whole process (OAuth and the open happen once).
+    """
+    global _SHEETS_CONNECTION
+    with _SHEETS_CONNECTION_LOCK:
+        if _SHEETS_CONNECTION is None:
+            import gspread
+            from oauth2client.service_account import ServiceAccountCredentials
+            
+            # Create a dict from the secrets object
+            creds_dict = dict(st.secrets["gcp_service_account"])
+            
+            # Scope
+            scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
+            
+            creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
+            gc = gspread.authorize(creds)
+            
+            # Open or Create Sheet
+            try:
+                sh = gc.open("TradingJournal_DB")
+            except gspread.SpreadsheetNotFound:
+                sh = gc.create("TradingJournal_DB")
+                # Share with user email if needed, or they can find it in Service Account Drive
+                # For now, just create
+            _SHEETS_CONNECTION = (gc, sh)
+        return _SHEETS_CONNECTION
+
+
+def _synchronized(method):
+    # Serializes a TradeManager write (whole read-modify-write) across threads/sessions
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._write_lock:
+            return method(self, *args, **kwargs)
+    return wrapper
 
-TRADES_FILE = "trades.csv"
-ACCOUNTS_FILE = "accounts.csv"
 
 class TradeManager:
-    def __init__(self):
-        self.stock_listing = None
+    """
+    Journal operations over one storage backend. A single instance can be
+    shared by every session of the process: writes are serialized by a
+    lock and a batch() is private to the thread that opened it.
+    """
+    def __init__(self, backend=None):
         self.use_gsheets = False
         self.gc = None
         self.sh = None
         
+        # Write-through table cache: filename -> DataFrame / source signature
+        self._tables = {}
+        self._table_sigs = {}
+        # TradeID -> row label in the current Trades table (built lazily)
+        self._trade_index = None
+        # Open unit of work per thread (see the _batch property)
+        self._local = threading.local()
+        self._write_lock = threading.RLock()
+        
+        # Connection and init_files are deferred to first use (see the backend property)
+        self._backend = backend
+        self._backend_ready = False
+        self._backend_initializing = False
+
+    @property
+    def backend(self):
+        if self._backend_ready:
+            return self._backend
+        # Same lock as writes, so first use from several threads initializes once without lock-order issues
+        with self._write_lock:
+            if not self._backend_ready:
+                if self._backend is None:
+                    self._backend = self._select_backend()
+                self.use_gsheets = isinstance(self._backend, SheetsBackend)
+                if not self._backend_initializing:
+                    # init_files itself goes through this property
+                    self._backend_initializing = True
+                    try:
+                        self.init_files()
+                    finally:
+                        self._backend_initializing = False
+                    self._backend_ready = True
+            return self._backend
+
+    @property
+    def _batch(self):
+        # filename -> _PendingTable for this thread's open batch (None outside batch())
+        return getattr(self._local, "batch", None)
+
+    @_batch.setter
+    def _batch(self, value):
+        self._local.batch = value
+
+    def _select_backend(self):
+        choice = os.environ.get(BACKEND_ENV, "").lower()
+        if choice == "sqlite":
+            return SQLiteBackend(os.environ.get(SQLITE_PATH_ENV, SQLITE_FILE))
+        if choice == "csv":
+            return CSVBackend()
+        if choice == "partitioned":
+            return PartitionedCSVBackend()
+        if choice == "sync":
+            from sheets_sync import SyncedBackend
+            self.connect_gsheets()
+            if self.use_gsheets:
+                return SyncedBackend(os.environ.get(SQLITE_PATH_ENV, SQLITE_FILE), SheetsBackend(self.sh))
+            print("Sheets unavailable: using the local SQLite store without sync")
+            return SQLiteBackend(os.environ.get(SQLITE_PATH_ENV, SQLITE_FILE))
+        
         # Try connecting to Google Sheets
         self.connect_gsheets()
-        
-        # Init data
-        self.init_files()
+        if self.use_gsheets:
+            return SheetsBackend(self.sh)
+        return CSVBackend()
 
     def connect_gsheets(self):
         if not HAS_GSHEETS:
@@ -37,106 +643,335 @@ class TradeManager:
 
         try:
             if "gcp_service_account" in st.secrets:
-                # Create a dict from the secrets object
-                creds_dict = dict(st.secrets["gcp_service_account"])
-                
-                # Scope
-                scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-                
-                creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-                self.gc = gspread.authorize(creds)
-                
-                # Open or Create Sheet
-                try:
-                    self.sh = self.gc.open("TradingJournal_DB")
-                except gspread.SpreadsheetNotFound:
-                    self.sh = self.gc.create("TradingJournal_DB")
-                    # Share with user email if needed, or they can find it in Service Account Drive
-                    # For now, just create
-                    
+                self.gc, self.sh = _open_spreadsheet()
                 self.use_gsheets = True
                 print("Connected to Google Sheets!")
         except Exception as e:
             print(f"GSheets Connection Failed (using CSV): {e}")
             self.use_gsheets = False
 
-    def _get_worksheet(self, name):
-        if not self.use_gsheets: return None
-        try:
-            return self.sh.worksheet(name)
-        except:
-            return self.sh.add_worksheet(title=name, rows=100, cols=20)
-
-    def _load_df(self, filename):
-        if self.use_gsheets:
-            ws_name = "Accounts" if filename == ACCOUNTS_FILE else "Trades"
-            ws = self._get_worksheet(ws_name)
-            data = ws.get_all_records()
-            if not data:
-                return pd.DataFrame() # Return empty if no records
-            return pd.DataFrame(data)
-        else:
-            if os.path.exists(filename):
-                return pd.read_csv(filename)
-            return pd.DataFrame()
+    def _load_df(self, filename, copy=True):
+        # copy=False hands out the cached frame itself: callers must not modify it
+        take = (lambda df: df.copy()) if copy else (lambda df: df)
+        # Inside a batch, later operations see the earlier (uncommitted) ones. The working
+        # copy is private to the batch's thread, so it is handed out as is, not copied per operation
+        if self._batch is not None and filename in self._batch:
+            return self._batch[filename].df
+        
+        with PROFILER.span("load_df", table=filename) as ev:
+            # Serve from memory unless the underlying file/sheet changed since we last saw it
+            sig = self.backend.signature(filename)
+            ev["hit"] = filename in self._tables and self._table_sigs.get(filename) == sig
+            if ev["hit"]:
+                return take(self._tables[filename])
+            
+            # Reloads swap the shared cache, so they wait for in-flight writes
+            with self._write_lock:
+                sig = self.backend.signature(filename)
+                if filename not in self._tables or self._table_sigs.get(filename) != sig:
+                    df = self._coerce_types(self.backend.read_table(filename), filename)
+                    self._set_table(filename, df, sig)
+                    if PROFILER.active:
+                        ev["bytes_read"] = frame_bytes(df)
+                return take(self._tables[filename])
 
     def _save_df(self, df, filename):
-        if self.use_gsheets:
-            ws_name = "Accounts" if filename == ACCOUNTS_FILE else "Trades"
-            ws = self._get_worksheet(ws_name)
-            ws.clear()
-            # Update with header and data
-            ws.update([df.columns.values.tolist()] + df.values.tolist())
+        # Full rewrite (rows removed or header changed)
+        self._stage(filename, df, rewrite=True)
+
+    def _append_row(self, df, row, filename):
+        """
+        Appends one row to storage. `df` is the table as loaded, before the row.
+        A row with a different set of columns turns into a full rewrite.
+        """
+        self._append_rows(df, pd.DataFrame([row]), filename)
+
+    def _append_rows(self, df, rows, filename):
+        # Many-row version of _append_row (one concat, one staged change)
+        if filename == TRADES_FILE:
+            # Only the new rows are cast; the loaded table already has the schema
+            new_df = apply_trade_schema(concat_trades(df, apply_trade_schema(rows)))
         else:
-            df.to_csv(filename, index=False)
+            new_df = pd.concat([df, rows], ignore_index=True)
+        relabel = None
+        if not df.index.equals(pd.RangeIndex(len(df))):
+            # concat renumbers the rows: cells recorded earlier in the batch must follow them
+            relabel = dict(zip(df.index, range(len(df))))
+        self._stage(filename, new_df, rewrite=list(new_df.columns) != list(df.columns), relabel=relabel)
+        if filename == TRADES_FILE and self._trade_index is not None:
+            if df.index.equals(pd.RangeIndex(len(df))):
+                # Keep the index current instead of rebuilding it
+                self._trade_index.update(zip(new_df['TradeID'].iloc[len(df):].astype(int), new_df.index[len(df):]))
+            else:
+                self._trade_index = None  # concat relabelled the rows
 
-    def init_files(self):
-        if self.use_gsheets:
-            # Check if worksheets exist, init headers if empty
-            for name, cols in [("Accounts", ["AccountID", "Broker", "Currency", "InitialBalance", "CurrentBalance"]),
-                               ("Trades", ["TradeID", "AccountID", "Symbol", "EntryDate", "Strategy", "TrendScore", 
-                                           "EntryPrice", "StopLoss", "Quantity", "UnitQuantity", "RiskAmount", 
-                                           "Status", "ExitDate", "ExitPrice", "PnL", "R_Multiple"])]:
-                ws = self._get_worksheet(name)
-                if not ws.get_all_values():
-                    ws.append_row(cols)
+    def _update_cells(self, df, filename, indices, columns):
+        """
+        Writes back only the given rows/columns of an already-modified `df`.
+        `df` must be the table as loaded (row order = storage order).
+        """
+        self._stage(filename, df, updated=(indices, columns))
+
+    def _trades_for_edit(self):
+        """
+        Trades table for a cell edit (_write_trade_cells). Outside a batch this is
+        the cached table itself, so an edit costs no whole-table copy; in a batch,
+        its working copy.
+        """
+        in_batch = self._batch is not None
+        return self._load_df(TRADES_FILE, copy=in_batch and TRADES_FILE not in self._batch)
+
+    def _write_trade_cells(self, df, idx, values):
+        # set_trade_cells on one row of _trades_for_edit() + write-back of those cells.
+        # An in-place edit of the cached table is undone if the write fails.
+        old = {col: df.at[idx, col] for col in values if col in df.columns} if self._batch is None else None
+        set_trade_cells(df, idx, values)
+        try:
+            self._update_cells(df, TRADES_FILE, [idx], list(values))
+        except Exception:
+            if old is not None:
+                for col, value in old.items():
+                    df.at[idx, col] = value
+            raise
+
+    def _stage(self, filename, df, rewrite=False, updated=None, relabel=None):
+        # Record a change; commit it now, or at the end of the open batch.
+        # relabel: {old row label: new label} when `df` renumbered the rows
+        pending = self._batch.get(filename) if self._batch is not None else None
+        if pending is None:
+            base = self._tables.get(filename)
+            pending = _PendingTable(len(base) if base is not None else 0)
+        pending.df = df
+        pending.rewrite = pending.rewrite or rewrite
+        if relabel is not None:
+            pending.updated = {relabel[idx]: cols for idx, cols in pending.updated.items() if idx in relabel}
+        if pending.updated:
+            # Rows deleted since their cells were recorded
+            pending.updated = {idx: cols for idx, cols in pending.updated.items() if idx in df.index}
+        if updated is not None:
+            indices, columns = updated
+            for idx in indices:
+                # Cells of rows appended in this batch go out with the append itself
+                if df.index.get_loc(idx) < pending.base_rows:
+                    pending.updated.setdefault(idx, set()).update(columns)
+        if rewrite and filename == TRADES_FILE:
+            self._trade_index = None
+        
+        if self._batch is not None:
+            self._batch[filename] = pending
         else:
-            if not os.path.exists(ACCOUNTS_FILE):
-                df = pd.DataFrame(columns=["AccountID", "Broker", "Currency", "InitialBalance", "CurrentBalance"])
-                df.to_csv(ACCOUNTS_FILE, index=False)
+            self._commit(filename, pending)
+
+    def _commit(self, filename, pending):
+        with PROFILER.span("save_df", table=filename, rewrite=pending.rewrite) as ev:
+            self.backend.write_changes(filename, pending.df, pending.base_rows, pending.updated, pending.rewrite)
+            if PROFILER.active:
+                if pending.rewrite or pending.base_rows == 0:
+                    ev["bytes_written"] = frame_bytes(pending.df)
+                else:
+                    # Appended rows + changed cells (approximate)
+                    appended = frame_bytes(pending.df.iloc[pending.base_rows:])
+                    cell_bytes = frame_bytes(pending.df) / max(pending.df.size, 1)
+                    cells = sum(len(cols) for cols in pending.updated.values())
+                    ev["bytes_written"] = int(appended + cells * cell_bytes)
+        # Write-through: keep our copy current and record the post-write signature
+        trade_index = self._trade_index
+        df = pending.df
+        if not df.index.equals(pd.RangeIndex(len(df))):
+            df = df.reset_index(drop=True)
+        self._set_table(filename, df, self.backend.signature(filename, force=True))
+        if filename == TRADES_FILE and not pending.rewrite:
+            # Row labels are unchanged by appends/cell updates
+            self._trade_index = trade_index
+
+    def _set_table(self, filename, df, sig):
+        self._tables[filename] = df
+        self._table_sigs[filename] = sig
+        if filename == TRADES_FILE:
+            self._trade_index = None
+
+    @contextmanager
+    def batch(self):
+        """
+        Unit of work for multi-trade operations:
+
+            with tm.batch():
+                tm.close_trade(1, 71000)
+                tm.close_trade(2, 53000)
+
+        Adds, closes, edits and balance changes made inside the block are
+        applied to working copies, validated together, and each touched table
+        is written once on exit. If the block raises, nothing is written.
+        Nested batches join the outer one.
+        """
+        if self._batch is not None:
+            yield self
+            return
+        
+        # Other sessions' writes wait until this batch is committed or discarded
+        with self._write_lock:
+            self._batch = {}
+            try:
+                yield self
+                pending = self._batch
+            finally:
+                self._batch = None
+                # Labels may refer to discarded working copies
+                self._trade_index = None
             
-            if not os.path.exists(TRADES_FILE):
-                cols = ["TradeID", "AccountID", "Symbol", "EntryDate", "Strategy", 
-                        "TrendScore", "EntryPrice", "StopLoss", "Quantity", "UnitQuantity", 
-                        "RiskAmount", "Status", "ExitDate", "ExitPrice", "PnL", "R_Multiple"]
-                df = pd.DataFrame(columns=cols)
-                df.to_csv(TRADES_FILE, index=False)
+            self._validate(pending)
+            # Trades first, then balances (same order as the single-trade path)
+            for filename in (TRADES_FILE, ACCOUNTS_FILE):
+                if filename in pending:
+                    self._commit(filename, pending[filename])
+
+    def _validate(self, pending):
+        if TRADES_FILE in pending:
+            trades = pending[TRADES_FILE].df
+            if not trades.empty and trades['TradeID'].duplicated().any():
+                raise ValueError("Batch would create duplicate TradeIDs")
+        if ACCOUNTS_FILE in pending:
+            accounts = pending[ACCOUNTS_FILE].df
+            if not accounts.empty and accounts['AccountID'].duplicated().any():
+                raise ValueError("Batch would create duplicate accounts")
+
+    def _find_trade(self, trade_id):
+        """
+        O(1) TradeID -> row label lookup. The label is valid for the frame
+        returned by the latest _load_df(TRADES_FILE). Returns None if absent.
+        """
+        if self._trade_index is None:
+            if self._batch is not None and TRADES_FILE in self._batch:
+                trades = self._batch[TRADES_FILE].df
+            else:
+                trades = self._tables.get(TRADES_FILE)
+            if trades is None or trades.empty:
+                return None
+            self._trade_index = dict(zip(trades['TradeID'].astype(int), trades.index))
+        return self._trade_index.get(int(trade_id))
+
+    def _allocate_trade_id(self, df, count=1):
+        # Monotonic and persisted, so IDs of deleted trades are never handed out again.
+        # Returns the first of `count` consecutive IDs.
+        last = int(self.backend.read_meta("last_trade_id", 0) or 0)
+        if not df.empty:
+            last = max(last, int(df['TradeID'].max()))
+        self.backend.write_meta("last_trade_id", last + count)
+        return last + 1
+
+    def _repair_trade_ids(self):
+        # Journals written before the allocator existed can contain duplicate IDs
+        df = self._load_df(TRADES_FILE)
+        if df.empty:
+            return
+        dup = df['TradeID'].duplicated()
+        if dup.any():
+            next_id = int(df['TradeID'].max())
+            for idx in df.index[dup]:
+                next_id += 1
+                set_trade_cells(df, idx, {'TradeID': next_id})
+            self.backend.write_meta("last_trade_id", next_id)
+            self._update_cells(df, TRADES_FILE, df.index[dup], ['TradeID'])
+
+    def _coerce_types(self, df, filename):
+        # Trades get their declared dtypes once, as they come out of storage (see TRADE_SCHEMA)
+        if filename == TRADES_FILE:
+            return apply_trade_schema(df)
+        return df
+
+    def _upgrade_accounts(self):
+        # Journals from before display names: each existing AccountID stays the key and becomes the name
+        df = self._load_df(ACCOUNTS_FILE)
+        if 'AccountID' not in df.columns:
+            return
+        if 'Name' not in df.columns:
+            df.insert(1, 'Name', df['AccountID'].astype(str))
+            self._save_df(df, ACCOUNTS_FILE)
+            return
+        blank = df['Name'].isna() | (df['Name'].astype(str) == "")
+        if blank.any():
+            df.loc[blank, 'Name'] = df.loc[blank, 'AccountID'].astype(str)
+            self._update_cells(df, ACCOUNTS_FILE, df.index[blank], ['Name'])
+
+    @_synchronized
+    def init_files(self):
+        self.backend.init_tables()
+        self._upgrade_accounts()
+        self._repair_trade_ids()
+
+    # --- Sheets replication (JOURNAL_BACKEND=sync) ---
+    def sync_status(self):
+        """{pending, conflicts (DataFrame), last_sync, last_error}, or None when not replicating."""
+        status = getattr(self.backend, "status", None)
+        return status() if status else None
+
+    def sync_now(self):
+        if hasattr(self.backend, "sync_once"):
+            return self.backend.sync_once()
+
+    def resolve_sync_conflict(self, table, key, keep):
+        self.backend.resolve_conflict(table, key, keep)
 
     # --- Account Management ---
     def get_accounts(self):
         return self._load_df(ACCOUNTS_FILE)
 
+    def get_account_names(self):
+        """{AccountID: display name}"""
+        df = self.get_accounts()
+        if df.empty:
+            return {}
+        return dict(zip(df['AccountID'].astype(str), df['Name'].astype(str)))
+
+    def resolve_account(self, account):
+        # AccountID for a key or a display name (CLI arguments), None if unknown
+        names = self.get_account_names()
+        if str(account) in names:
+            return str(account)
+        return next((k for k, n in names.items() if n == str(account)), None)
+
+    def _allocate_account_id(self, df):
+        # Monotonic like TradeIDs; also skips keys still referenced by stored trades
+        # (older journals used the account names themselves as keys)
+        used = set(df['AccountID'].astype(str)) if not df.empty else set()
+        trades = self._load_df(TRADES_FILE, copy=False)
+        if not trades.empty:
+            used.update(trades['AccountID'].astype(str).unique())
+        n = int(self.backend.read_meta("last_account_id", 0) or 0)
+        while True:
+            n += 1
+            if f"{ACCOUNT_KEY_PREFIX}{n}" not in used:
+                break
+        self.backend.write_meta("last_account_id", n)
+        return f"{ACCOUNT_KEY_PREFIX}{n}"
+
+    @_synchronized
     def add_account(self, name, broker, balance):
         df = self.get_accounts()
-        if not df.empty and name in df['AccountID'].values:
+        if not df.empty and name in df['Name'].values:
             return False, "Account ID already exists"
         
         new_row = {
-            "AccountID": name,
+            "AccountID": self._allocate_account_id(df),
+            "Name": name,
             "Broker": broker,
             "Currency": "KRW",
             "InitialBalance": balance,
             "CurrentBalance": balance
         }
-        df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-        self._save_df(df, ACCOUNTS_FILE)
+        self._append_row(df, new_row, ACCOUNTS_FILE)
         return True, "Account added"
 
+    @_synchronized
     def delete_account(self, account_id):
-        # 1. Delete associated trades
-        t_df = self._load_df(TRADES_FILE)
-        t_df = t_df[t_df['AccountID'] != str(account_id)]
-        self._save_df(t_df, TRADES_FILE)
+        # 1. Delete associated trades: one indexed delete where the backend supports it.
+        # Otherwise they stay stored but hidden (get_trades drops orphans) - account keys
+        # are never reused, so they can't resurface under another account.
+        if self._batch is None and self.backend.delete_account_trades(str(account_id)):
+            trades = self._tables.get(TRADES_FILE)
+            if trades is not None:
+                self._set_table(TRADES_FILE, trades[trades['AccountID'] != str(account_id)].reset_index(drop=True),
+                                self.backend.signature(TRADES_FILE, force=True))
         
         # 2. Delete account
         df = self.get_accounts()
@@ -144,61 +979,62 @@ class TradeManager:
         self._save_df(df, ACCOUNTS_FILE)
         return True
 
-    def update_account(self, old_id, new_id, new_balance):
+    @_synchronized
+    def update_account(self, account_id, name, new_balance):
+        # Renames touch only the account row: trades reference the AccountID key
         df = self.get_accounts()
-        idx = df[df['AccountID'] == old_id].index
+        idx = df[df['AccountID'] == account_id].index
         if len(idx) > 0:
             # Name Validation
-            if old_id != new_id and new_id in df['AccountID'].values:
+            if name in df.loc[df['AccountID'] != account_id, 'Name'].values:
                 return False, "이미 존재하는 계좌명입니다."
             
-            # Update Trades first if ID changed
-            if old_id != new_id:
-                self._update_trades_account_id(old_id, new_id)
-            
             current_idx = idx[0]
-            df.at[current_idx, 'AccountID'] = new_id
+            df.at[current_idx, 'Name'] = name
             df.at[current_idx, 'CurrentBalance'] = new_balance
-            self._save_df(df, ACCOUNTS_FILE)
+            self._update_cells(df, ACCOUNTS_FILE, [current_idx], ['Name', 'CurrentBalance'])
             return True, "수정 완료"
         return False, "계좌 찾기 실패"
 
-    def _update_trades_account_id(self, old_id, new_id):
-        df = self.get_trades()
-        if not df.empty:
-            df.loc[df['AccountID'] == str(old_id), 'AccountID'] = str(new_id)
-            self._save_df(df, TRADES_FILE)
-
     # --- Trade Management ---
-    def get_trades(self, account_id=None, status=None):
-        df = self._load_df(TRADES_FILE)
-        if df.empty: return df
-        
-        # Ensure correct types
-        num_cols = ["TradeID", "EntryPrice", "StopLoss", "Quantity", "RiskAmount", "ExitPrice", "PnL", "R_Multiple"]
-        for col in num_cols:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
-
-        if account_id:
-            df = df[df['AccountID'] == str(account_id)] # Ensure str comparison
+    def get_trades(self, account_id=None, status=None, symbols=None, strategies=None,
+                   date_from=None, date_to=None, date_field="ExitDate",
+                   columns=None, sort=None, descending=False, limit=None):
+        """
+        Trades matching every given filter:
+        - account_id: one AccountID or a list of them
+        - status: "Open" / "Closed"; symbols, strategies: value or list
+        - date_from / date_to: inclusive "YYYY-MM-DD" (or date) bounds on date_field
+        - columns: projection; sort (column or list), descending, limit
+        Backends that support queries evaluate this at the source.
+        """
+        to_text = lambda d: d.strftime("%Y-%m-%d") if hasattr(d, "strftime") else d
+        query = TradeQuery(account_id or None, status, symbols, strategies,
+                           to_text(date_from), to_text(date_to), date_field, columns, sort, descending, limit)
+        if query.symbols is not None:
+            # Match both zero-padded and stripped KRX codes
+            query.symbols = list({v for s in query.symbols for v in (s, normalize_symbol(s), s.lstrip("0") or s)})
         
-        # Filter out orphans (AccountID not in Accounts file)
+        # Orphans (AccountID not in Accounts) are filtered as part of the query
         acc_df = self.get_accounts()
-        valid_ids = []
-        if not acc_df.empty:
-            valid_ids = acc_df['AccountID'].astype(str).tolist()
+        valid_ids = acc_df['AccountID'].astype(str).tolist() if not acc_df.empty else []
+        if query.accounts is None:
+            query.accounts = valid_ids
+        else:
+            query.accounts = [a for a in query.accounts if a in set(valid_ids)]
         
-        # Always filter. If valid_ids is empty, this returns empty df (which is correct if no accounts)
-        df = df[df['AccountID'].astype(str).isin(valid_ids)]
-            
-        if status:
-            df = df[df['Status'] == status]
-        return df
+        if self.backend.supports_queries and self._batch is None:
+            # Filtered, projected and ordered at the source instead of loading the whole history
+            return self._coerce_types(self.backend.query_trades(query), TRADES_FILE)
+        # The cached table is already typed at load time (see _coerce_types)
+        # (apply() always builds a new frame, so the cached table is not copied first)
+        return query.apply(self._load_df(TRADES_FILE, copy=False))
 
+    @_synchronized
     def add_trade(self, account_id, symbol, strategy, trend_score, entry, sl, qty, unit_qty, risk, entry_date=None):
-        df = self._load_df(TRADES_FILE)
-        new_id = len(df) + 1
+        # Not copied: the append builds a new frame
+        df = self._load_df(TRADES_FILE, copy=False)
+        new_id = self._allocate_trade_id(df)
         
         e_date = entry_date if entry_date else datetime.now().strftime("%Y-%m-%d")
         
@@ -215,89 +1051,98 @@ class TradeManager:
             "UnitQuantity": int(unit_qty),
             "RiskAmount": int(risk),
             "Status": "Open",
-            "ExitDate": "",
-            "ExitPrice": 0.0,
+            "ExitDate": None,
+            "ExitPrice": None,
             "PnL": 0.0,
             "R_Multiple": 0.0
         }
-        df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-        self._save_df(df, TRADES_FILE)
+        self._append_row(df, new_row, TRADES_FILE)
         return True
 
+    @_synchronized
+    def add_trades(self, trades):
+        """
+        Appends many trades at once (e.g. an import). `trades` is a DataFrame
+        with TRADE_COLUMNS except TradeID, which is allocated here.
+        Returns the assigned TradeIDs.
+        """
+        if trades.empty:
+            return []
+        df = self._load_df(TRADES_FILE, copy=False)
+        first_id = self._allocate_trade_id(df, len(trades))
+        
+        rows = trades.copy()
+        rows['TradeID'] = range(first_id, first_id + len(rows))
+        rows = rows.reindex(columns=df.columns if not df.empty else TRADE_COLUMNS)
+        self._append_rows(df, rows, TRADES_FILE)
+        return rows['TradeID'].tolist()
+
+    @_synchronized
     def close_trade(self, trade_id, exit_price):
-        df = self._load_df(TRADES_FILE)
-        idx = df[df['TradeID'] == trade_id].index
-        if len(idx) == 0:
+        df = self._trades_for_edit()
+        idx = self._find_trade(trade_id)
+        if idx is None:
             return False
         
-        idx = idx[0]
-        entry = float(df.at[idx, 'EntryPrice'])
-        qty = int(df.at[idx, 'Quantity'])
-        sl = float(df.at[idx, 'StopLoss'])
-        
-        # Fee Calculation (Updated based on user feedback)
-        # Tax: 0.20% (Sell only)
-        # Fee: 0.015% (Buy & Sell)
-        # Fee Calculation (Kiwoom Standard: Floor to 10 won for Fee, 1 won for Tax)
-        # Tax: 0.20% (Sell only) | Fee: 0.015% (Buy & Sell)
-        import math
-        
-        exit_amt = exit_price * qty
-        entry_amt = entry * qty
-        
-        buy_fee = math.floor((entry_amt * 0.00015) / 10) * 10
-        sell_fee = math.floor((exit_amt * 0.00015) / 10) * 10
-        tax = math.floor(exit_amt * 0.002)
-        
-        total_fee = buy_fee + sell_fee + tax
-        
-        gross_pnl = exit_amt - entry_amt
-        net_pnl = gross_pnl - total_fee
-        
-        risk_dist = abs(entry - sl)
-        r_mult = (exit_price - entry) / risk_dist if risk_dist != 0 else 0
-
-        df.at[idx, 'Status'] = "Closed"
-        df.at[idx, 'ExitPrice'] = exit_price
-        df.at[idx, 'ExitDate'] = datetime.now().strftime("%Y-%m-%d")
-        df.at[idx, 'PnL'] = net_pnl
-        df.at[idx, 'R_Multiple'] = round(r_mult, 2)
-        
-        self._save_df(df, TRADES_FILE)
+        # Fee Calculation (Kiwoom Standard, see calculate_pnl)
+        pnl = calculate_pnl([df.at[idx, 'EntryPrice']], [int(df.at[idx, 'Quantity'])], [exit_price],
+                            [df.at[idx, 'StopLoss']]).iloc[0]
+        net_pnl = float(pnl['NetPnL'])
+        r_mult = float(pnl['R_Multiple'])
+
+        self._write_trade_cells(df, idx, {
+            'Status': "Closed",
+            'ExitPrice': exit_price,
+            'ExitDate': datetime.now().strftime("%Y-%m-%d"),
+            'PnL': net_pnl,
+            'R_Multiple': round(r_mult, 2),
+        })
         
         acc_id = df.at[idx, 'AccountID']
         self.update_account_balance(acc_id, net_pnl)
         
         return True
 
+    def close_trades(self, exit_prices):
+        """
+        Closes several trades in one batch ({trade_id: exit_price}).
+        Returns the IDs that were closed.
+        """
+        with self.batch():
+            return [tid for tid, price in exit_prices.items() if self.close_trade(tid, price)]
+
+    @_synchronized
     def update_account_balance(self, account_id, pnl):
         df = self.get_accounts()
         if not df.empty and account_id in df['AccountID'].values:
-            df.loc[df['AccountID'] == account_id, 'CurrentBalance'] = pd.to_numeric(df.loc[df['AccountID'] == account_id, 'CurrentBalance']) + pnl
-            self._save_df(df, ACCOUNTS_FILE)
+            mask = df['AccountID'] == account_id
+            df.loc[mask, 'CurrentBalance'] = pd.to_numeric(df.loc[mask, 'CurrentBalance']) + pnl
+            self._update_cells(df, ACCOUNTS_FILE, df.index[mask], ['CurrentBalance'])
             
+    @_synchronized
     def delete_trade(self, trade_id):
-        df = self._load_df(TRADES_FILE)
+        # Not copied: drop() builds a new frame
+        df = self._load_df(TRADES_FILE, copy=False)
+        idx = self._find_trade(trade_id)
+        if idx is None:
+            return True
         
         # Check for balance reversal
-        trade_rows = df[df['TradeID'] == trade_id]
-        if not trade_rows.empty:
-            row = trade_rows.iloc[0]
-            if row['Status'] == 'Closed':
-                pnl = float(row['PnL']) if pd.notnull(row['PnL']) else 0.0
-                if pnl != 0:
-                    self.update_account_balance(row['AccountID'], -pnl)
+        row = df.loc[idx]
+        if row['Status'] == 'Closed':
+            pnl = float(row['PnL']) if pd.notnull(row['PnL']) else 0.0
+            if pnl != 0:
+                self.update_account_balance(row['AccountID'], -pnl)
                     
-        df = df[df['TradeID'] != trade_id]
+        df = df.drop(index=idx)
         self._save_df(df, TRADES_FILE)
         return True
 
+    @_synchronized
     def update_trade(self, trade_id, updates):
-        df = self._load_df(TRADES_FILE)
-        idx = df[df['TradeID'] == trade_id].index
-        if len(idx) > 0:
-            current_idx = idx[0]
-            
+        df = self._trades_for_edit()
+        current_idx = self._find_trade(trade_id)
+        if current_idx is not None:
             # Check if PnL is being changed -> Update Balance
             if 'PnL' in updates:
                 old_pnl = float(df.at[current_idx, 'PnL']) if pd.notnull(df.at[current_idx, 'PnL']) else 0.0
@@ -308,9 +1153,14 @@ class TradeManager:
                     acc_id = df.at[current_idx, 'AccountID']
                     self.update_account_balance(acc_id, diff)
             
-            for key, val in updates.items():
-                df.at[current_idx, key] = val
-            self._save_df(df, TRADES_FILE)
+            new_cols = [key for key in updates if key not in df.columns]
+            if new_cols:
+                # Schema change: the header itself needs rewriting (on a copy)
+                df = df.copy()
+                set_trade_cells(df, current_idx, updates)
+                self._save_df(df, TRADES_FILE)
+            else:
+                self._write_trade_cells(df, current_idx, updates)
             return True
         return False
 
@@ -323,7 +1173,7 @@ class TradeManager:
         3. SL Distance
         """
         # 1. Adjust Capital based on Trend
-        trend_factor = {3: 1.0, 2: 0.6666, 1: 0.3333}.get(trend_score, 1.0)
+        trend_factor = TREND_FACTORS.get(trend_score, 1.0)
         adjusted_capital = capital * trend_factor
         
         # 2. Calculate Risk Amount
@@ -349,36 +1199,126 @@ class TradeManager:
             "unit_qty": unit_qty
         }
 
+    def calculate_position_grid(self, capital, entry_prices, sl_pcts, risk_pcts, trend_scores=(3,), deposit=None):
+        """Batch calculate_position over ranges of inputs (see size_positions)."""
+        return size_positions(capital, entry_prices, sl_pcts, risk_pcts, trend_scores, deposit)
+
     def fetch_current_price(self, symbol):
+        if not PROFILER.active:
+            return QUOTE_CACHE.get(symbol, self._download_price)
+        
+        misses = []
+        def loader(key):
+            misses.append(key)
+            return self._download_price(key)
+        with PROFILER.span("fetch_current_price", symbol=normalize_symbol(symbol)) as ev:
+            price = QUOTE_CACHE.get(symbol, loader)
+            ev["hit"] = not misses
+        return price
+
+    def invalidate_quotes(self, symbols=None):
+        # Drop cached quotes (all, or just the given symbols) so the next read refetches
+        QUOTE_CACHE.invalidate(symbols)
+
+    def start_quote_prefetcher(self):
+        QUOTE_PREFETCHER.start(self)
+
+    def get_quote_snapshot(self, symbols):
+        """
+        Non-blocking marks from the background prefetcher.
+        Returns ({symbol: price}, as_of); symbols not yet fetched are left out.
+        """
+        return QUOTE_PREFETCHER.snapshot(list(symbols))
+
+    def refresh_quotes(self, symbols=None):
+        """Refetches quotes (default: all open positions) and publishes them to the snapshot."""
+        if symbols is None:
+            open_trades = self.get_trades(status="Open")
+            symbols = [] if open_trades.empty else open_trades['Symbol'].unique()
+        symbols = list(symbols)
+        self.invalidate_quotes(symbols)
+        prices = self.fetch_current_prices(symbols)
+        QUOTE_PREFETCHER.publish(prices)
+        return prices
+
+    def _download_price(self, symbol):
+        # Last close from the local OHLC store (incremental fetch only when stale)
         try:
-            # KRX fallback and zero-padding logic
-            target_symbol = str(symbol)
-            if target_symbol.isdigit() and len(target_symbol) < 6:
-                target_symbol = target_symbol.zfill(6)
-            
-            # Fetch last 10 days
-            from datetime import timedelta
-            start_date = (datetime.now() - timedelta(days=10)).strftime("%Y-%m-%d")
-            
-            df = fdr.DataReader(target_symbol, start=start_date)
-            if not df.empty:
-                return float(df['Close'].iloc[-1])
+            return OHLC_STORE.last_close(symbol)
         except Exception as e:
             print(f"Error fetching price for {symbol}: {e}")
             return None
-        return None
 
-    def get_stock_name(self, symbol):
-        try:
-            target_symbol = str(symbol)
-            if target_symbol.isdigit() and len(target_symbol) < 6:
-                target_symbol = target_symbol.zfill(6)
-                
-            if self.stock_listing is None:
-                # Cache KRX listing (covers KOSPI, KOSDAQ)
-                df_krx = fdr.StockListing('KRX')
-                self.stock_listing = df_krx[['Code', 'Name']].set_index('Code')['Name'].to_dict()
+    def get_price_history(self, symbol, start=None):
+        """Daily OHLC bars for charts/analytics (served from the local store)."""
+        return OHLC_STORE.history(symbol, start=start)
+
+    def fetch_current_prices(self, symbols):
+        """
+        Fetches current prices for many symbols at once.
+        Duplicates are fetched once, on a bounded thread pool.
+        Returns {symbol: price} keyed by the symbols as given (None on failure/timeout).
+        """
+        symbols = list(symbols)
+        unique = list(dict.fromkeys(normalize_symbol(s) for s in symbols))
+        prices = {}
+        if unique:
+            workers = min(QUOTE_MAX_WORKERS, len(unique))
+            executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="quote")
+            # Workers inherit the caller's profiling activation (session tags)
+            fetch = PROFILER.bind(self.fetch_current_price)
+            futures = {sym: executor.submit(fetch, sym) for sym in unique}
             
-            return self.stock_listing.get(target_symbol, None)
-        except Exception:
-            return None
+            # Each symbol gets QUOTE_TIMEOUT seconds; queued symbols wait for a free worker
+            waves = -(-len(unique) // workers)
+            wait(futures.values(), timeout=QUOTE_TIMEOUT * waves)
+            for sym, fut in futures.items():
+                prices[sym] = None
+                if not fut.done():
+                    print(f"Timed out fetching price for {sym}")
+                elif fut.cancelled():
+                    print(f"Price fetch for {sym} was cancelled")
+                elif fut.exception() is not None:
+                    print(f"Error fetching price for {sym}: {fut.exception()}")
+                else:
+                    prices[sym] = fut.result()
+            # Don't block the page on stragglers
+            executor.shutdown(wait=False, cancel_futures=True)
+        return {s: prices.get(normalize_symbol(s)) for s in symbols}
+
+    def value_positions(self, trades, prices=None):
+        """
+        Marks open trades to market in one vectorized pass.
+        Returns calculate_pnl() columns plus CurrentPrice and HasQuote, indexed like `trades`.
+        Positions without a quote are valued at their entry price.
+        """
+        if prices is None:
+            prices = self.fetch_current_prices(trades['Symbol'].tolist())
+        quotes = pd.to_numeric(trades['Symbol'].map(prices), errors='coerce')
+        has_quote = quotes > 0
+        marks = quotes.where(has_quote, trades['EntryPrice']).astype(float)
+        
+        pnl = calculate_pnl(trades['EntryPrice'], trades['Quantity'], marks, trades['StopLoss'])
+        pnl['CurrentPrice'] = marks
+        pnl['HasQuote'] = has_quote
+        return pnl
+
+    def get_stock_name(self, symbol):
+        with PROFILER.span("get_stock_name") as ev:
+            try:
+                name = STOCK_LISTING.get(normalize_symbol(symbol))
+            except Exception:
+                name = None
+            ev["hit"] = name is not None
+        return name
+
+    def get_stock_names(self, symbols):
+        """Bulk name lookup: {symbol: name or None} for the symbols as given."""
+        with PROFILER.span("get_stock_names") as ev:
+            unique = list(dict.fromkeys(symbols))
+            names = STOCK_LISTING.get_many(normalize_symbol(s) for s in unique)
+            ev["symbols"] = len(unique)
+        return {s: names.get(normalize_symbol(s)) for s in unique}
+
+    def stock_listing_ready(self):
+        return STOCK_LISTING.is_ready()